@@ -1,44 +1,116 @@
+import time
+STARTED = time.perf_counter()  # clock for --startup-report
+
 import sqlite3
-import random
 import tkinter as tk
 from tkinter import ttk, filedialog
+import argparse
 import os
-import tempfile
-import datetime
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from collections import defaultdict
-import numpy as np
-
-try:
-    from gtts import gTTS
-    import pygame
-except ImportError as e:
-    print("Please install the required dependencies by running:")
-    print("pip install -r requirements.txt")
-    print("Error details:", e)
-    exit(1)
+import sys
+from vocab_db import VOCAB_TABLES, VocabRepository
+from vocab_session import ReviewSession
+from vocab_stats import DailyStats
+from vocab_trace import tracer
+# matplotlib is imported when the chart is first shown, gTTS and pygame on
+# the first pronunciation
+from vocab_audio import AudioPlayer, Prefetcher, TTSCache
+
+IMPORTED = time.perf_counter()
+
+
+class StartupReport:
+    # Startup phases in the layout of `python -X importtime`: time spent in
+    # each phase and cumulative time since the module started loading
+    def __init__(self, enabled=False, budget_ms=1000):
+        self.enabled = enabled
+        self.budget_ms = budget_ms
+        self.marks = [("imports", IMPORTED)]
+        self.first_paint = None
+
+    def mark(self, phase):
+        if self.enabled:
+            self.marks.append((phase, time.perf_counter()))
+
+    def report(self):
+        if not self.enabled:
+            return
+        print("startup: self [ms] | cumulative [ms] | phase", file=sys.stderr)
+        previous = STARTED
+        for phase, timestamp in self.marks:
+            print(f"startup: {(timestamp - previous) * 1000:9.1f} | {(timestamp - STARTED) * 1000:16.1f} | {phase}", file=sys.stderr)
+            previous = timestamp
+            if phase == "first paint":
+                self.first_paint = (timestamp - STARTED) * 1000
+        if self.first_paint is not None and self.first_paint > self.budget_ms:
+            print(f"startup: first paint took {self.first_paint:.1f} ms, over the {self.budget_ms:.0f} ms budget", file=sys.stderr)
+        self.enabled = False
+
+
+# What --trace times besides every SQL statement: the review hot paths from
+# keypress to database, the stats file and the widgets
+TRACED = [
+    (VocabRepository, ["move_word", "flush", "count", "fetch_ids", "fetch_page", "refresh_exe", "clear_table",
+                       "search", "reviews_for_date", "daily_totals", "changed"], "db"),
+    (ReviewSession, ["select_table", "next_word", "mark", "refresh", "sync", "upcoming"], "session"),
+    (DailyStats, ["seed", "flush"], "stats"),
+]
+
+
+def enable_tracing():
+    # Only called with --trace, so without it nothing is wrapped
+    tracer.enable()
+    for owner, names, category in TRACED:
+        tracer.instrument(owner, names, category)
+    tracer.instrument(VocabularyApp, ["display_word", "mark_word", "update_chart", "refresh_vocabulary_list",
+                                      "save_daily_stats", "flush_daily_stats", "poll_changes"], "ui")
+
 
 class VocabularyApp:
-    def __init__(self):
-        self.db_file = None
-        self.current_table = None
-        self.current_word_index = 0
-        self.vocabulary_data = []
+    def __init__(self, write_behind=False, flush_every=20, flush_interval_ms=2000,
+                 tts_cache_bytes=200 * 1024 * 1024, offline=False, prefetch_cards=5, chart_frame_ms=200,
+                 startup_report=None, change_poll_ms=1000, trace_file=None):
+        self.startup = startup_report or StartupReport()
+        # With tracing enabled the timings are written here on close
+        self.trace_file = trace_file
+        # Write-behind batches word transitions into one commit every
+        # flush_every reviews or flush_interval_ms, whichever comes first
+        self.session = ReviewSession(write_behind=write_behind, flush_every=flush_every)
+        self.flush_interval_ms = flush_interval_ms
+        self.flush_job = None
+        # Pronunciations are cached in a tts_cache folder next to the database;
+        # offline mode only plays audio that is already cached
+        self.tts_cache_bytes = tts_cache_bytes
+        self.offline = offline
+        # Word and sentence audio for this many upcoming cards is synthesized
+        # in the background
+        self.prefetch_cards = prefetch_cards
+        self.prefetcher = None
+        # The chart is redrawn at most once per chart_frame_ms
+        self.chart_frame_ms = chart_frame_ms
+        self.chart_job = None
+        self.chart_dates = None
+        self.chart_bars = []
+        self.ax = None
+        # Tables currently shown in the Listbox, in display order
+        self.listed_tables = []
         self.translation_visible = False
-        self.review_mode = "sequence"
-        pygame.mixer.init()
-        self.words_reviewed = 0
-        self.words_known = set()
-        self.words_unknown = set()
-        self.daily_stats = defaultdict(lambda: {"reviewed": 0, "known": 0, "unknown": 0})
-        self.log_file = None
+        self.audio = AudioPlayer()
+        self.stats_flush_job = None
+        # Ids of the words listed in the search results
+        self.search_ids = []
+        self.search_job = None
+        # Every change_poll_ms the deck is checked for commits by other
+        # windows or scripts, which then show up here
+        self.change_poll_ms = change_poll_ms
+        self.change_job = None
         self.create_ui()
-        self.load_daily_stats()
+        self.startup.mark("ui built")
+        self.window.after(50, self.poll_audio_events)
 
     def create_ui(self):
         self.window = tk.Tk()
         self.window.title("Vocabulary App")
+        self.window.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # Main frame to hold left and right sections
         main_frame = ttk.Frame(self.window)
@@ -48,9 +120,10 @@ class VocabularyApp:
         left_frame = ttk.Frame(main_frame)
         left_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
-        # Right frame for the chart
+        # Right frame for the chart, filled in once the window is on screen
         self.right_frame = ttk.Frame(main_frame, width=400)
         self.right_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
+        self.right_frame.bind("<Map>", self.on_stats_pane_shown)
 
         # Add stats frame to left frame
         self.stats_frame = ttk.Frame(left_frame)
@@ -73,9 +146,25 @@ class VocabularyApp:
         self.table_listbox.bind("<<ListboxSelect>>", self.on_table_select)
 
         scrollbar = ttk.Scrollbar(self.table_frame, orient=tk.VERTICAL, command=self.table_listbox.yview)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        scrollbar.pack(side=tk.LEFT, fill=tk.Y)
         self.table_listbox.config(yscrollcommand=scrollbar.set)
 
+        #search words, translations and examples; pick a hit to review it
+        search_frame = ttk.Frame(self.table_frame)
+        search_frame.pack(side=tk.LEFT, padx=10)
+
+        search_label = ttk.Label(search_frame, text="Search", font=("Arial", 14, "bold"))
+        search_label.pack(side=tk.TOP)
+
+        self.search_entry = ttk.Entry(search_frame, width=30)
+        self.search_entry.pack(side=tk.TOP)
+        self.search_entry.bind("<KeyRelease>", self.on_search_key)
+        self.search_entry.bind("<Return>", self.on_search_return)
+
+        self.search_listbox = tk.Listbox(search_frame, width=40, height=8, exportselection=False)
+        self.search_listbox.pack(side=tk.TOP)
+        self.search_listbox.bind("<<ListboxSelect>>", self.on_search_select)
+
         button_frame = ttk.Frame(left_frame)
         button_frame.pack()
 
@@ -94,6 +183,12 @@ class VocabularyApp:
         random_button = ttk.Button(button_frame, text="Random", command=lambda: self.set_review_mode("random"))
         random_button.pack(side=tk.LEFT, padx=5)
 
+        weighted_button = ttk.Button(button_frame, text="Weighted", command=lambda: self.set_review_mode("weighted"))
+        weighted_button.pack(side=tk.LEFT, padx=5)
+
+        due_button = ttk.Button(button_frame, text="Due", command=lambda: self.set_review_mode("due"))
+        due_button.pack(side=tk.LEFT, padx=5)
+
         refresh_button = ttk.Button(button_frame, text="Refresh Vocabulary", command=self.refresh_vocabulary)
         refresh_button.pack(side=tk.LEFT, padx=5)
 
@@ -156,7 +251,8 @@ class VocabularyApp:
 
         instructions = [
             "1. Select a vocabulary table from the list.",
-            "2. Choose 'Sequence' or 'Random' review mode.",
+            "2. Choose 'Sequence', 'Random', 'Weighted' or 'Due' review mode ('Random' shows every word once before repeating,",
+            "   'Weighted' shows words from new_vocab more often, 'Due' shows the words scheduled for review).",
             "3. Click 'Y' or Left key if you know the word, 'N' or Right key if you don't.",
             "4. Use 'Refresh Vocabulary' to reset the word list.",
             "5. Use 'Clear Known Vocab List' and 'Clear New Vocab List' to manage your lists.",
@@ -165,7 +261,8 @@ class VocabularyApp:
             "8. known_vocab has words that you know.",
             "9. new_vocab has words that you need to memorizie.",
             "10. Click 'Toggle Translation' or Down key to show/hide English translations.",
-            "11. Click 'Show Current Translation' or Up key to reveal the translation for the current word."
+            "11. Click 'Show Current Translation' or Up key to reveal the translation for the current word.",
+            "12. Type in 'Search' to find a word (accents optional); press Return or click a result to review it."
         ]
 
         for instruction in instructions:
@@ -175,29 +272,68 @@ class VocabularyApp:
         self.status_label = ttk.Label(left_frame, text="")
         self.status_label.pack()
 
-        # Create the chart
-        self.create_chart()
+    def on_stats_pane_shown(self, event):
+        self.right_frame.unbind("<Map>")
+        self.startup.mark("window shown")
+        self.window.after_idle(self.on_first_paint)
+
+    def on_first_paint(self):
+        self.startup.mark("first paint")
+        # Give Tk a moment to finish drawing before matplotlib loads
+        self.window.after(10, self.create_chart)
 
     def create_chart(self):
-        fig, ax = plt.subplots(figsize=(5, 4))
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+        fig = Figure(figsize=(5, 4))
+        ax = fig.add_subplot()
         self.canvas = FigureCanvasTkAgg(fig, master=self.right_frame)
         self.canvas.draw()
         self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+        self.figure = fig
         self.ax = ax
+        self.update_chart()
+        self.startup.mark("chart loaded")
+        self.startup.report()
+
+    def schedule_chart_update(self):
+        if self.chart_job is None:
+            self.chart_job = self.window.after(self.chart_frame_ms, self.update_chart)
 
     def update_chart(self):
-        self.ax.clear()
-        dates = list(self.daily_stats.keys())[-7:]  # Last 7 days
-        reviewed = [self.daily_stats[date]["reviewed"] for date in dates]
-        known = [self.daily_stats[date]["known"] for date in dates]
-        unknown = [self.daily_stats[date]["unknown"] for date in dates]
+        if self.chart_job is not None:
+            self.window.after_cancel(self.chart_job)
+            self.chart_job = None
+        if self.ax is None:
+            # Drawn with the current stats once the chart has loaded
+            return
+        recent = self.session.daily_stats.recent(7)  # Last 7 days
+        dates = [date for date, stats in recent]
+        reviewed = [stats["reviewed"] for date, stats in recent]
+        known = [stats["known"] for date, stats in recent]
+        unknown = [stats["unknown"] for date, stats in recent]
+
+        if dates == self.chart_dates:
+            # Same days as last time: only the bar heights change
+            for bars, values in zip(self.chart_bars, (reviewed, known, unknown)):
+                for bar, value in zip(bars, values):
+                    bar.set_height(value)
+            self.ax.relim()
+            self.ax.autoscale_view()
+            self.canvas.draw_idle()
+            return
 
-        x = np.arange(len(dates))  # the label locations
+        self.ax.clear()
+        x = list(range(len(dates)))  # the label locations
         width = 0.25  # the width of the bars
 
-        self.ax.bar(x - width, reviewed, width, label='Reviewed', color='blue')
-        self.ax.bar(x, known, width, label='Known', color='green')
-        self.ax.bar(x + width, unknown, width, label='Unknown', color='red')
+        self.chart_bars = [
+            self.ax.bar([i - width for i in x], reviewed, width, label='Reviewed', color='blue'),
+            self.ax.bar(x, known, width, label='Known', color='green'),
+            self.ax.bar([i + width for i in x], unknown, width, label='Unknown', color='red'),
+        ]
+        self.chart_dates = dates
 
         self.ax.set_xlabel('Date')
         self.ax.set_ylabel('Number of Words')
@@ -206,80 +342,104 @@ class VocabularyApp:
         self.ax.set_xticklabels(dates, rotation=45, ha='right')
         self.ax.legend()
 
-        plt.tight_layout()
+        self.figure.tight_layout()
         self.canvas.draw()
 
-    def load_daily_stats(self):
-        if self.log_file and os.path.exists(self.log_file):
-            with open(self.log_file, 'r') as f:
-                for line in f:
-                    date, reviewed, known, unknown = line.strip().split(',')
-                    self.daily_stats[date] = {
-                        "reviewed": int(reviewed),
-                        "known": int(known),
-                        "unknown": int(unknown)
-                    }
-        self.update_chart()
-
     def save_daily_stats(self):
-        today = datetime.date.today().isoformat()
-        self.daily_stats[today] = {
-            "reviewed": self.words_reviewed,
-            "known": len(self.words_known),
-            "unknown": len(self.words_unknown)
-        }
-        
-        with open(self.log_file, 'w') as f:
-            for date, stats in self.daily_stats.items():
-                f.write(f"{date},{stats['reviewed']},{stats['known']},{stats['unknown']}\n")
-        
-        self.update_chart()
+        # The session has recorded the review; coalesce writes to the stats file
+        if self.stats_flush_job is None:
+            self.stats_flush_job = self.window.after(self.flush_interval_ms, self.flush_daily_stats)
+        self.schedule_chart_update()
+
+    def flush_daily_stats(self):
+        self.stats_flush_job = None
+        self.session.daily_stats.flush()
 
     #function to control visibility of translation
     def toggle_translation(self):
         self.translation_visible = not self.translation_visible
         self.display_word()
 
-    def open_database(self):
-        self.db_file = filedialog.askopenfilename(filetypes=[("SQLite Database", "*.db")])
-        if self.db_file:
-            self.log_file = os.path.join(os.path.dirname(self.db_file), "vocab_stats.txt")
-            self.load_daily_stats()
-            self.explore_database()
+    def open_database(self, db_file=None):
+        db_file = db_file or filedialog.askopenfilename(filetypes=[("SQLite Database", "*.db")])
+        if not db_file:
+            return False
+        try:
+            self.session.open(db_file)
+        except (sqlite3.Error, ValueError) as e:
+            message = f"Could not open {db_file}: {e}"
+            print(message)
+            self.status_label.config(text=message)
+            # Any deck open before is closed by now
+            self.table_listbox.delete(0, tk.END)
+            return False
+        cache_dir = os.path.join(os.path.dirname(db_file), "tts_cache")
+        self.audio.cache = TTSCache(cache_dir, max_bytes=self.tts_cache_bytes, offline=self.offline)
+        if self.prefetcher:
+            self.prefetcher.close()
+        self.prefetcher = None if self.offline else Prefetcher(self.audio.cache, max_items=2 * (self.prefetch_cards + 1))
+        self.update_chart()
+        self.update_stats()
+        self.explore_database()
+        if self.change_job is None:
+            self.change_job = self.window.after(self.change_poll_ms, self.poll_changes)
+        self.startup.mark("deck opened")
+        return True
 
     def explore_database(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-
-        self.table_listbox.delete(0, tk.END)
-        for table in tables:
-            table_name = table[0]
-            cursor.execute(f"SELECT COUNT(*) FROM {table_name};")
-            word_count = cursor.fetchone()[0]
-            self.table_listbox.insert(tk.END, f"{table_name} ({word_count} words)")
+        self.show_table_counts(self.session.tables())
 
-        conn.close()
-        self.status_label.config(text=f"Database: {self.db_file}")
+        self.status_label.config(text=f"Database: {self.session.db_file}")
 
     def on_table_select(self, event):
         if self.table_listbox.curselection():
             index = self.table_listbox.curselection()[0]
-            self.current_table = self.table_listbox.get(index).split(" ")[0]
-            self.load_vocabulary_data()
-            self.current_word_index = 0
-            self.display_word()
-
-    def load_vocabulary_data(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-
-        cursor.execute(f"SELECT * FROM {self.current_table};")
-        self.vocabulary_data = cursor.fetchall()
-
-        conn.close()
+            self.select_table(self.table_listbox.get(index).split(" ")[0])
+
+    def on_search_key(self, event):
+        # Search once typing pauses
+        if self.search_job is not None:
+            self.window.after_cancel(self.search_job)
+        self.search_job = self.window.after(150, self.run_search)
+
+    def run_search(self):
+        self.search_job = None
+        self.search_listbox.delete(0, tk.END)
+        self.search_ids = []
+        if not self.session.repo:
+            return
+        try:
+            results = self.session.search(self.search_entry.get())
+        except sqlite3.Error as e:
+            print(f"An error occurred while searching: {e}")
+            return
+        for word_id, french_word, english_translation in results:
+            self.search_listbox.insert(tk.END, f"{french_word} - {english_translation}")
+            self.search_ids.append(word_id)
+
+    def on_search_return(self, event):
+        # Jump to the best match; "break" keeps Return from playing audio
+        if self.search_job is not None:
+            self.window.after_cancel(self.search_job)
+            self.run_search()
+        if self.search_ids:
+            self.jump_to_word(self.search_ids[0])
+        return "break"
+
+    def on_search_select(self, event):
+        if self.search_listbox.curselection():
+            self.jump_to_word(self.search_ids[self.search_listbox.curselection()[0]])
+
+    def jump_to_word(self, word_id):
+        self.session.jump_to(word_id)
+        self.show_new_word()
+        # Give the review keys back to the card
+        self.window.focus_set()
+
+    def select_table(self, table_name):
+        self.session.select_table(table_name)
+        self.show_new_word()
+        self.startup.mark("first card")
 
     # def display_word(self):
     #     if self.vocabulary_data:
@@ -297,8 +457,8 @@ class VocabularyApp:
     #         self.translation_label.config(text="")
 
     def display_word(self):
-        if self.vocabulary_data:
-           word_data = self.vocabulary_data[self.current_word_index]
+        word_data = self.session.current_word()
+        if word_data:
            self.id_label.config(text=f"ID: {word_data[0]}")
            self.french_label.config(text=word_data[1])
         
@@ -316,121 +476,66 @@ class VocabularyApp:
            self.english_label.config(text="")
            self.example_label.config(text="")
            self.translation_label.config(text="")
+           if self.session.review_mode == "due" and self.session.has_words():
+              self.french_label.config(text="Nothing due right now")
 
     def show_current_translation(self):
-        if self.vocabulary_data:
-           word_data = self.vocabulary_data[self.current_word_index]
+        word_data = self.session.current_word()
+        if word_data:
            self.english_label.config(text=f"English: {word_data[2]}")
            self.translation_label.config(text=f"Translation: {word_data[4]}")
     
     def set_review_mode(self, mode):
-        self.review_mode = mode
-        self.display_next_word()
+        self.session.set_review_mode(mode)
+        self.show_new_word()
         self.refresh_vocabulary_list()
 
     def display_next_word(self):
-        if self.review_mode == "sequence":
-            self.current_word_index = (self.current_word_index + 1) % len(self.vocabulary_data)
-        else:
-            self.current_word_index = random.randint(0, len(self.vocabulary_data) - 1)
-        self.display_word()
+        self.session.next_word()
+        self.show_new_word()
 
-
-    def display_next_word(self):
-        if self.vocabulary_data:
-            if self.review_mode == "sequence":
-             # Get the list of indexes from the current table
-               conn = sqlite3.connect(self.db_file)
-               cursor = conn.cursor()
-               cursor.execute(f"SELECT id FROM {self.current_table} ORDER BY id")
-               indexes = [row[0] for row in cursor.fetchall()]
-               conn.close()
-
-               # Find the next smallest index greater than the current index
-               next_index = None
-               for index in indexes:
-                   if index > self.vocabulary_data[self.current_word_index][0]:
-                       next_index = index
-                       break
-
-               # If no next index found, wrap around to the smallest index
-               if next_index is None:
-                   next_index = indexes[0]
-
-               # Find the index of the word with the next smallest index
-               self.current_word_index = next((i for i, word in enumerate(self.vocabulary_data) if word[0] == next_index), 0)
-            else:
-               # Get the list of indexes from the current table
-               conn = sqlite3.connect(self.db_file)
-               cursor = conn.cursor()
-               cursor.execute(f"SELECT id FROM {self.current_table}")
-               indexes = [row[0] for row in cursor.fetchall()]
-               conn.close()
-
-               # Randomly select an index from the list of indexes
-               random_index = random.choice(indexes)
-
-               # Find the index of the word with the randomly selected index
-               self.current_word_index = next((i for i, word in enumerate(self.vocabulary_data) if word[0] == random_index), 0)
-
-            self.display_word()   
+    def show_new_word(self):
+        # Audio for the previous word is stale now
+        self.audio.stop()
+        self.display_word()
+        self.prefetch_upcoming()
 
     def mark_word_known(self):
-        word_data = self.vocabulary_data[self.current_word_index]
-        self.remove_word_from_table(word_data, "new_vocab")
-        self.remove_word_from_table(word_data, "vocab_exe")
-        self.add_word_to_table(word_data, "known_vocab")
-        self.words_reviewed += 1
-        self.words_known.add(word_data[0])  # Add word ID to known set
-        self.words_unknown.discard(word_data[0])  # Remove from unknown set if present
-        self.update_stats()
-        self.display_next_word()
-        self.refresh_vocabulary_list()
-        self.save_daily_stats()
+        self.mark_word("Y")
 
     def mark_word_new(self):
-        word_data = self.vocabulary_data[self.current_word_index]
-        self.remove_word_from_table(word_data, "known_vocab")
-        self.remove_word_from_table(word_data, "vocab_exe")
-        self.add_word_to_table(word_data, "new_vocab")
-        self.words_reviewed += 1
-        self.words_unknown.add(word_data[0])  # Add word ID to unknown set
-        self.words_known.discard(word_data[0])  # Remove from known set if present
+        self.mark_word("N")
+
+    def mark_word(self, known):
+        if self.session.mark(known) is None:
+            return
         self.update_stats()
-        self.display_next_word()
-        self.refresh_vocabulary_list()
+        self.show_new_word()
+        if self.session.pending:
+            # Queued transitions refresh the counts when they are flushed
+            if self.flush_job is None:
+                self.flush_job = self.window.after(self.flush_interval_ms, self.flush_writes)
+        else:
+            self.refresh_vocabulary_list()
         self.save_daily_stats()
 
-    def remove_word_from_table(self, word_data, table_name):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-
-        # Check if the word exists in the table
-        cursor.execute(f"SELECT COUNT(*) FROM {table_name} WHERE id = ?", (word_data[0],))
-        count = cursor.fetchone()[0]
-
-        if count > 0:
-            # If the word exists, delete it from the table
-            cursor.execute(f"DELETE FROM {table_name} WHERE id = ?", (word_data[0],))
-            conn.commit()
-        else: 
-            # If the word doesn't exist, do nothing
-            pass
-        conn.close()
-
-    def add_word_to_table(self, word_data, table_name):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-
+    def poll_changes(self):
+        self.change_job = self.window.after(self.change_poll_ms, self.poll_changes)
         try:
-        # Try to insert the word into the table
-            cursor.execute(f"INSERT INTO {table_name} VALUES (?, ?, ?, ?, ?)", word_data)
-            conn.commit()
-        except sqlite3.IntegrityError:
-            # If the word already exists, do nothing
-            pass
-        finally:
-           conn.close()
+            changed = self.session.sync()
+        except sqlite3.Error as e:
+            print(f"An error occurred while checking the database for changes: {e}")
+            return
+        if changed:
+            self.update_stats()
+            self.refresh_vocabulary_list()
+            self.display_word()
+            self.schedule_chart_update()
+
+    def flush_writes(self):
+        self.flush_job = None
+        self.session.flush()
+        self.refresh_vocabulary_list()
 
 #this is old version should not be used since it doesnt remove words from known and new vocab list
     # def refresh_vocabulary(self):
@@ -448,101 +553,77 @@ class VocabularyApp:
     #     self.refresh_vocabulary_list()
 
     def clear_known_vocab(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-
-        cursor.execute("DELETE FROM known_vocab")
-
-        conn.commit()
-        conn.close()
+        self.session.clear_known()
         self.refresh_vocabulary_list()
 
     def clear_new_vocab(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-
-        cursor.execute("DELETE FROM new_vocab")
-
-        conn.commit()
-        conn.close()
+        self.session.clear_new()
         self.refresh_vocabulary_list()
 
     def refresh_vocabulary(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-
         try:
-           # Delete all words from vocab_exe
-           cursor.execute("DELETE FROM vocab_exe")
-
-           # Copy all words from vocabulary to vocab_exe
-           cursor.execute("INSERT INTO vocab_exe SELECT * FROM vocabulary")
-
-          # Remove words from vocab_exe that are in known_vocab
-           cursor.execute("""
-              DELETE FROM vocab_exe
-              WHERE id IN (
-                  SELECT id FROM known_vocab
-               )
-           """)
-
-           # Remove words from vocab_exe that are in new_vocab
-           cursor.execute("""
-              DELETE FROM vocab_exe
-                WHERE id IN (
-                 SELECT id FROM new_vocab
-              )
-           """)
-
-           conn.commit()
+           self.session.refresh()
         except sqlite3.Error as e:
             print(f"An error occurred while refreshing vocabulary: {e}")
-        finally:
-           conn.close()
 
-        self.words_reviewed = 0
-        self.words_known.clear()
-        self.words_unknown.clear()
         self.update_stats()
-
-        self.load_vocabulary_data()
-        self.current_word_index = 0
         self.display_word()
         self.refresh_vocabulary_list()
-        self.save_daily_stats()
 
     def update_stats(self):
-        stats_text = f"Reviewed: {self.words_reviewed} | Known: {len(self.words_known)} | Unknown: {len(self.words_unknown)}"
+        # Today's totals from the review log, so they include earlier sessions
+        # and other windows and are not reset by a refresh
+        stats = self.session.today_stats()
+        stats_text = f"Reviewed: {stats['reviewed']} | Known: {stats['known']} | Unknown: {stats['unknown']}"
         self.stats_label.config(text=stats_text)
 
     def refresh_vocabulary_list(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-
-        self.table_listbox.delete(0, tk.END)
-        for table_name in ["vocabulary", "vocab_exe", "known_vocab", "new_vocab"]:
-            cursor.execute(f"SELECT COUNT(*) FROM {table_name};")
-            word_count = cursor.fetchone()[0]
-            self.table_listbox.insert(tk.END, f"{table_name} ({word_count} words)")
-
-        conn.close()
+        if self.session.repo:
+            self.show_table_counts(VOCAB_TABLES)
+
+    def show_table_counts(self, tables):
+        entries = [f"{table_name} ({word_count} words)" for table_name, word_count in self.session.table_counts(tables)]
+        if self.listed_tables != tables:
+            self.table_listbox.delete(0, tk.END)
+            for entry in entries:
+                self.table_listbox.insert(tk.END, entry)
+            self.listed_tables = list(tables)
+            return
+
+        # Same tables as before: only rewrite the entries whose count changed
+        for i, entry in enumerate(entries):
+            if self.table_listbox.get(i) != entry:
+                self.table_listbox.delete(i)
+                self.table_listbox.insert(i, entry)
+
+    def prefetch_upcoming(self):
+        current = self.session.current_word()
+        if not self.prefetcher or current is None:
+            return
+
+        # The current card first, then the upcoming ones in review order
+        items = []
+        for word_data in [current] + self.session.upcoming(self.prefetch_cards):
+            items.append((word_data[1], 'fr'))
+            items.append((word_data[3], 'fr'))
+        self.prefetcher.prefetch(items)
 
     def play_pronunciation(self, text, language='en'):
-        try:
-           tts = gTTS(text=text, lang=language)
-           with tempfile.NamedTemporaryFile(delete=True) as fp:
-               tts.save(f"{fp.name}.mp3")
-               pygame.mixer.music.load(f"{fp.name}.mp3")
-               pygame.mixer.music.play()
-               while pygame.mixer.music.get_busy():
-                   pygame.time.Clock().tick(10)
-        except Exception as e:
-            print(f"An error occurred while playing the pronunciation: {e}")
+        # Returns immediately, the audio thread does the synthesis and playback
+        self.audio.play(text, language)
+
+    def poll_audio_events(self):
+        while not self.audio.events.empty():
+            kind, message = self.audio.events.get_nowait()
+            if kind == "error":
+                print(message)
+                self.status_label.config(text=message)
+        self.window.after(50, self.poll_audio_events)
     
     #pronounce sentence
     def play_sentence_pronunciation(self):
-        if self.vocabulary_data:
-            word_data = self.vocabulary_data[self.current_word_index]
+        word_data = self.session.current_word()
+        if word_data:
             french_sentence = word_data[3]
             if french_sentence:
                 self.play_pronunciation(french_sentence, language='fr')
@@ -551,29 +632,94 @@ class VocabularyApp:
     
     #pronounce word
     def play_current_pronunciation(self):
-        if self.vocabulary_data:
-            word_data = self.vocabulary_data[self.current_word_index]
+        word_data = self.session.current_word()
+        if word_data:
             french_word = word_data[1]
             self.play_pronunciation(french_word, language='fr')
 
+    def typing_search(self, event):
+        # The review keys move the cursor while the search box has focus
+        return event.widget is self.search_entry
+
+    def trace_keypress(self, key, started):
+        # Idle callbacks run after the redraw the key caused, so this spans
+        # from the keypress until the next card is on screen
+        if tracer.enabled:
+            self.window.after_idle(lambda: tracer.record("keypress_to_paint", started, "ui", {"key": key}))
+
     def on_left_key(self, event):
-        self.mark_word_known()
+        if not self.typing_search(event):
+            started = time.perf_counter()
+            self.mark_word_known()
+            self.trace_keypress("Left", started)
 
     def on_right_key(self, event):
-        self.mark_word_new()
+        if not self.typing_search(event):
+            started = time.perf_counter()
+            self.mark_word_new()
+            self.trace_keypress("Right", started)
 
     def on_up_key(self, event):
-        self.show_current_translation()
+        if not self.typing_search(event):
+            self.show_current_translation()
 
     def on_down_key(self, event):
-        self.toggle_translation()
+        if not self.typing_search(event):
+            self.toggle_translation()
 
     def on_return_key(self, event):
-        self.play_current_pronunciation()
+        if not self.typing_search(event):
+            self.play_current_pronunciation()
+
+    def on_close(self):
+        self.audio.close()
+        if self.stats_flush_job is not None:
+            self.window.after_cancel(self.stats_flush_job)
+        if self.chart_job is not None:
+            self.window.after_cancel(self.chart_job)
+        if self.search_job is not None:
+            self.window.after_cancel(self.search_job)
+        if self.change_job is not None:
+            self.window.after_cancel(self.change_job)
+        if self.prefetcher:
+            self.prefetcher.close()
+            stats = self.prefetcher.stats()
+            print(f"Pronunciation cache: {stats['hits']} hits, {stats['misses']} misses, {stats['prefetched']} prefetched")
+        if self.flush_job is not None:
+            self.window.after_cancel(self.flush_job)
+        # Flushes queued transitions and the stats file
+        self.session.close()
+        self.window.destroy()
+        if self.trace_file:
+            tracer.export(self.trace_file)
+            tracer.print_summary()
+            print(f"Trace written to {self.trace_file}", file=sys.stderr)
 
     def run(self):
         self.window.mainloop()
 
-# Example usage
-app = VocabularyApp()
-app.run()
\ No newline at end of file
+def main():
+    parser = argparse.ArgumentParser(description="Review French vocabulary from an SQLite deck.")
+    parser.add_argument("db_file", nargs="?", help="deck to open on startup")
+    parser.add_argument("--table", default="vocab_exe", help="table to review when a deck is given")
+    parser.add_argument("--write-behind", action="store_true", help="batch word transitions into fewer commits")
+    parser.add_argument("--offline", action="store_true", help="only play pronunciations that are already cached")
+    parser.add_argument("--startup-report", action="store_true", help="print startup phase timings to stderr")
+    parser.add_argument("--startup-budget-ms", type=float, default=1000, help="time-to-first-paint budget for --startup-report")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="time keypresses, hot paths and SQL; on exit write a Chrome trace-event JSON file "
+                             "and print latency histograms to stderr")
+    args = parser.parse_args()
+
+    if args.trace:
+        enable_tracing()
+    app = VocabularyApp(write_behind=args.write_behind, offline=args.offline,
+                        startup_report=StartupReport(args.startup_report, args.startup_budget_ms),
+                        trace_file=args.trace)
+    if args.db_file and app.open_database(args.db_file):
+        app.select_table(args.table)
+    app.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ import random
 import tkinter as tk
 from tkinter import ttk, filedialog
 
+from vocab_db import TableCounts, connect_deck
+
 import os
 import tempfile
 try:
@@ -17,6 +19,7 @@ except ImportError as e:
 class VocabularyApp:
     def __init__(self):
         self.db_file = None
+        self.table_counts = TableCounts()
         self.current_table = None
         self.current_word_index = 0
         self.vocabulary_data = []
@@ -153,20 +156,14 @@ class VocabularyApp:
     def open_database(self):
         self.db_file = filedialog.askopenfilename(filetypes=[("SQLite Database", "*.db")])
         if self.db_file:
+            self.table_counts = TableCounts()
             self.explore_database()
 
     def explore_database(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
+        conn = connect_deck(self.db_file)
 
         self.table_listbox.delete(0, tk.END)
-        for table in tables:
-            table_name = table[0]
-            cursor.execute(f"SELECT COUNT(*) FROM {table_name};")
-            word_count = cursor.fetchone()[0]
+        for table_name, word_count in self.table_counts.read(conn).items():
             self.table_listbox.insert(tk.END, f"{table_name} ({word_count} words)")
 
         conn.close()
@@ -181,7 +178,7 @@ class VocabularyApp:
             self.display_word()
 
     def load_vocabulary_data(self):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect_deck(self.db_file)
         cursor = conn.cursor()
 
         cursor.execute(f"SELECT * FROM {self.current_table};")
@@ -248,7 +245,7 @@ class VocabularyApp:
         if self.vocabulary_data:
             if self.review_mode == "sequence":
              # Get the list of indexes from the current table
-               conn = sqlite3.connect(self.db_file)
+               conn = connect_deck(self.db_file)
                cursor = conn.cursor()
                cursor.execute(f"SELECT id FROM {self.current_table} ORDER BY id")
                indexes = [row[0] for row in cursor.fetchall()]
@@ -269,7 +266,7 @@ class VocabularyApp:
                self.current_word_index = next((i for i, word in enumerate(self.vocabulary_data) if word[0] == next_index), 0)
             else:
                # Get the list of indexes from the current table
-               conn = sqlite3.connect(self.db_file)
+               conn = connect_deck(self.db_file)
                cursor = conn.cursor()
                cursor.execute(f"SELECT id FROM {self.current_table}")
                indexes = [row[0] for row in cursor.fetchall()]
@@ -300,7 +297,7 @@ class VocabularyApp:
         self.refresh_vocabulary_list()
 
     def remove_word_from_table(self, word_data, table_name):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect_deck(self.db_file)
         cursor = conn.cursor()
 
         # Check if the word exists in the table
@@ -317,7 +314,7 @@ class VocabularyApp:
         conn.close()
 
     def add_word_to_table(self, word_data, table_name):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect_deck(self.db_file)
         cursor = conn.cursor()
 
         try:
@@ -346,7 +343,7 @@ class VocabularyApp:
     #     self.refresh_vocabulary_list()
 
     def clear_known_vocab(self):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect_deck(self.db_file)
         cursor = conn.cursor()
 
         cursor.execute("DELETE FROM known_vocab")
@@ -356,7 +353,7 @@ class VocabularyApp:
         self.refresh_vocabulary_list()
 
     def clear_new_vocab(self):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect_deck(self.db_file)
         cursor = conn.cursor()
 
         cursor.execute("DELETE FROM new_vocab")
@@ -366,7 +363,7 @@ class VocabularyApp:
         self.refresh_vocabulary_list()
 
     def refresh_vocabulary(self):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect_deck(self.db_file)
         cursor = conn.cursor()
 
         try:
@@ -405,8 +402,7 @@ class VocabularyApp:
 
 
     def refresh_vocabulary_list(self):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
+        conn = connect_deck(self.db_file)
 
         self.table_listbox.delete(0, tk.END)
         for table_name in ["vocabulary", "vocab_exe", "known_vocab", "new_vocab"]:
@@ -0,0 +1,74 @@
+import random
+import sqlite3
+
+import pytest
+
+from vocab_bench import make_deck
+from vocab_session import NEW_WORD_WEIGHT, ReviewSession
+
+
+def open_session(tmp_path, size=200):
+    db_file = str(tmp_path / "deck.db")
+    make_deck(db_file, size)
+    session = ReviewSession()
+    session.open(db_file, log_file=str(tmp_path / "vocab_stats.txt"))
+    return session
+
+
+def test_weighted_mode_keeps_new_vocab_uniform(tmp_path):
+    random.seed(0)
+    session = open_session(tmp_path)
+    session.select_table("new_vocab")
+    session.set_review_mode("weighted")
+    for _ in range(20):
+        session.mark_new()
+    picker = session.picker
+    weights = {picker.weights[picker.position(word_id)] for word_id in session.word_index.ids}
+    assert weights == {1}
+    session.close()
+
+
+def test_weighted_mode_favours_new_vocab_elsewhere(tmp_path):
+    random.seed(0)
+    session = open_session(tmp_path)
+    session.select_table("vocabulary")
+    session.set_review_mode("weighted")
+    word_id = session.current_id
+    session.mark_new()
+    picker = session.picker
+    assert picker.weights[picker.position(word_id)] == NEW_WORD_WEIGHT
+    session.close()
+
+
+def test_sync_follows_other_writers(tmp_path):
+    session = open_session(tmp_path)
+    session.select_table("known_vocab")
+    other = ReviewSession()
+    other.open(session.db_file, log_file=str(tmp_path / "other_stats.txt"))
+    other.select_table("known_vocab")
+    for _ in range(5):
+        other.mark_new()
+    # An older script writing through the list views
+    conn = sqlite3.connect(session.db_file)
+    with conn:
+        conn.execute("INSERT INTO known_vocab (id) SELECT id FROM new_vocab ORDER BY id LIMIT 3")
+    conn.close()
+    assert session.sync()
+    ids = list(session.word_index.ids)
+    session.load_vocabulary_data()
+    assert ids == list(session.word_index.ids)
+    assert session.today_stats()["unknown"] == 5
+    other.close()
+    session.close()
+
+
+def test_open_rejects_a_file_that_is_not_a_deck(tmp_path):
+    db_file = str(tmp_path / "other.db")
+    conn = sqlite3.connect(db_file)
+    conn.execute("CREATE TABLE notes (id INTEGER PRIMARY KEY, text TEXT)")
+    conn.commit()
+    conn.close()
+    session = ReviewSession()
+    with pytest.raises(ValueError):
+        session.open(db_file, log_file=str(tmp_path / "vocab_stats.txt"))
+    assert session.repo is None
@@ -0,0 +1,291 @@
+import functools
+import hashlib
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from importlib import metadata
+
+# gTTS and pygame are imported on first use, off the Tk thread, so they do
+# not slow down startup
+MISSING_DEPENDENCIES = "Please install the required dependencies by running: pip install -r requirements.txt"
+
+
+@functools.lru_cache(maxsize=None)
+def tts_backend():
+    # Read from the package metadata so computing a cache key does not
+    # import gTTS
+    try:
+        return f"gtts-{metadata.version('gTTS')}"
+    except metadata.PackageNotFoundError:
+        return "gtts-"
+
+
+def synthesize_to(path, text, language):
+    from gtts import gTTS
+    gTTS(text=text, lang=language).save(path)
+
+
+class TTSCache:
+    # Synthesized audio on disk, keyed by a hash of the backend, language and
+    # text. index.json lists the entries from least to most recently used,
+    # and the oldest ones are evicted once max_bytes is exceeded.
+    def __init__(self, cache_dir, max_bytes=200 * 1024 * 1024, offline=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.index_file = os.path.join(cache_dir, "index.json")
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        # Lookups made on behalf of playback
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.load_index()
+
+    def load_index(self):
+        try:
+            with open(self.index_file, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = []
+        for key, size in entries:
+            if os.path.exists(self.path(key)):
+                self.entries[key] = size
+                self.total_bytes += size
+
+    def save_index(self):
+        with self.lock:
+            tmp_file = self.index_file + ".tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(list(self.entries.items()), f)
+            os.replace(tmp_file, self.index_file)
+
+    def key(self, text, language):
+        return hashlib.sha256(f"{tts_backend()}\0{language}\0{text}".encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def get(self, text, language):
+        key = self.key(text, language)
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        return self.path(key)
+
+    def fetch(self, text, language):
+        # Cached path, synthesizing on a miss; None when offline and missing
+        path = self.get(text, language)
+        if path is not None:
+            self.hits += 1
+            return path
+        self.misses += 1
+        if self.offline:
+            return None
+        return self.synthesize(text, language)
+
+    def synthesize(self, text, language):
+        key = self.key(text, language)
+        fd, tmp_path = tempfile.mkstemp(suffix=".part", dir=self.cache_dir)
+        os.close(fd)
+        try:
+            synthesize_to(tmp_path, text, language)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.add(key, os.path.getsize(self.path(key)))
+        return self.path(key)
+
+    def add(self, key, size):
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            evicted = []
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                old_key, old_size = self.entries.popitem(last=False)
+                self.total_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self.path(old_key))
+            except OSError:
+                pass
+        self.save_index()
+
+
+class Prefetcher:
+    # Synthesizes upcoming pronunciations into the cache on a few worker
+    # threads. Each prefetch() call replaces the previous batch, and at most
+    # max_items texts are queued at a time.
+    def __init__(self, cache, workers=2, max_items=10):
+        self.cache = cache
+        self.max_items = max_items
+        self.requests = queue.Queue()
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.counters = {"queued": 0, "prefetched": 0, "already_cached": 0, "cancelled": 0, "errors": 0}
+        self.workers = [threading.Thread(target=self._run, name=f"prefetch-{i}", daemon=True) for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def prefetch(self, items):
+        generation = self.cancel()
+        for text, language in items[:self.max_items]:
+            if text:
+                self.requests.put((generation, text, language))
+                self._count("queued")
+
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # Keep the shutdown signal for the workers
+                self.requests.put(None)
+                break
+            self._count("cancelled")
+        return generation
+
+    def close(self):
+        self.cancel()
+        for _ in self.workers:
+            self.requests.put(None)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats["hits"] = self.cache.hits
+        stats["misses"] = self.cache.misses
+        return stats
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def _run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            generation, text, language = request
+            if generation != self.generation:
+                self._count("cancelled")
+            elif self.cache.get(text, language) is not None:
+                self._count("already_cached")
+            else:
+                try:
+                    self.cache.synthesize(text, language)
+                    self._count("prefetched")
+                except Exception:
+                    self._count("errors")
+
+
+class AudioPlayer:
+    # Synthesizes and plays pronunciations on a worker thread. Only the most
+    # recent request matters: a new play() or stop() makes every earlier
+    # request stale, and stale audio is skipped or cut off. Errors are put on
+    # self.events for the Tk thread to pick up with window.after. When a
+    # TTSCache is attached, audio is played from and saved to the cache.
+    # The worker, and with it pygame, only starts on the first play().
+    def __init__(self):
+        self.cache = None
+        self.requests = queue.Queue()
+        self.events = queue.Queue()
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.worker = None
+
+    def play(self, text, language):
+        if self.worker is None:
+            self.worker = threading.Thread(target=self._run, name="audio", daemon=True)
+            self.worker.start()
+        self.requests.put((self._next_generation(), text, language))
+
+    def stop(self):
+        self._next_generation()
+
+    def close(self):
+        self.stop()
+        if self.worker is not None:
+            self.requests.put(None)
+        if self.cache is not None:
+            # Persist the recency order of cache hits
+            self.cache.save_index()
+
+    def _next_generation(self):
+        with self.lock:
+            self.generation += 1
+            return self.generation
+
+    def _is_stale(self, generation):
+        return generation != self.generation
+
+    def _run(self):
+        try:
+            import pygame
+            pygame.mixer.init()
+        except ImportError as e:
+            self.events.put(("error", f"{MISSING_DEPENDENCIES} ({e})"))
+            self.worker = None
+            return
+        except Exception as e:
+            self.events.put(("error", f"Could not start audio: {e}"))
+            self.worker = None
+            return
+
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            generation, text, language = request
+            if self._is_stale(generation):
+                continue
+            try:
+                self._play(generation, text, language)
+            except ImportError as e:
+                self.events.put(("error", f"{MISSING_DEPENDENCIES} ({e})"))
+            except Exception as e:
+                self.events.put(("error", f"An error occurred while playing the pronunciation: {e}"))
+        pygame.mixer.quit()
+
+    def _play(self, generation, text, language):
+        if self.cache is not None:
+            path = self.cache.fetch(text, language)
+            if path is None:
+                self.events.put(("error", f"No cached pronunciation for '{text}' (offline mode)"))
+            else:
+                self._play_file(generation, path)
+            return
+
+        fd, path = tempfile.mkstemp(suffix=".mp3")
+        os.close(fd)
+        try:
+            synthesize_to(path, text, language)
+            self._play_file(generation, path)
+        finally:
+            os.remove(path)
+
+    def _play_file(self, generation, path):
+        import pygame
+        if self._is_stale(generation):
+            return
+        pygame.mixer.music.load(path)
+        pygame.mixer.music.play()
+        while pygame.mixer.music.get_busy():
+            if self._is_stale(generation):
+                pygame.mixer.music.stop()
+                break
+            time.sleep(0.02)
+        pygame.mixer.music.unload()
@@ -0,0 +1,233 @@
+import argparse
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+from vocab_pack import write_pack
+from vocab_session import ReviewSession
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+# Same layout as the shipped decks
+DECK_SCHEMA = """
+CREATE TABLE vocabulary (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    french_word TEXT NOT NULL,
+    english_translation TEXT NOT NULL,
+    example_sentence TEXT NOT NULL,
+    sentence_translation TEXT NOT NULL
+);
+CREATE TABLE vocab_exe(
+  id INT,
+  french_word TEXT,
+  english_translation TEXT,
+  example_sentence TEXT,
+  sentence_translation TEXT
+);
+CREATE TABLE known_vocab (
+    id INTEGER PRIMARY KEY,
+    french_word TEXT NOT NULL,
+    english_translation TEXT NOT NULL,
+    example_sentence TEXT NOT NULL,
+    sentence_translation TEXT NOT NULL
+);
+CREATE TABLE new_vocab (
+    id INTEGER PRIMARY KEY,
+    french_word TEXT NOT NULL,
+    english_translation TEXT NOT NULL,
+    example_sentence TEXT NOT NULL,
+    sentence_translation TEXT NOT NULL
+);
+"""
+
+
+def make_deck(db_file, size, known_share=0.3, new_share=0.2, seed=0):
+    # A synthetic deck: every word is in vocabulary, a share of them is known
+    # or new, and the rest is in vocab_exe
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_file)
+    conn.executescript(DECK_SCHEMA)
+    rows = ((i, f"mot{i}", f"word {i}", f"Voici le mot{i} dans une phrase.", f"Here is word {i} in a sentence.")
+            for i in range(1, size + 1))
+    conn.executemany("INSERT INTO vocabulary VALUES (?, ?, ?, ?, ?)", rows)
+    ids = list(range(1, size + 1))
+    rng.shuffle(ids)
+    known = ids[:int(size * known_share)]
+    new = ids[len(known):len(known) + int(size * new_share)]
+    conn.executemany("INSERT INTO known_vocab SELECT * FROM vocabulary WHERE id = ?", ((i,) for i in known))
+    conn.executemany("INSERT INTO new_vocab SELECT * FROM vocabulary WHERE id = ?", ((i,) for i in new))
+    conn.execute("""
+        INSERT INTO vocab_exe SELECT * FROM vocabulary
+        WHERE id NOT IN (SELECT id FROM known_vocab) AND id NOT IN (SELECT id FROM new_vocab)
+    """)
+    conn.commit()
+    conn.close()
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def summarize(samples):
+    return {
+        "n": len(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "max_ms": max(samples) * 1000,
+    }
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def run_size(size, iterations, seed=0):
+    # Runs in its own process so peak RSS belongs to this deck size alone
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = os.path.join(tmp_dir, "deck.db")
+        start = time.perf_counter()
+        make_deck(db_file, size, seed=seed)
+        build_s = time.perf_counter() - start
+
+        random.seed(seed)
+        session = ReviewSession()
+        # The first open also migrates the deck to word_state
+        start = time.perf_counter()
+        session.open(db_file, log_file=os.path.join(tmp_dir, "vocab_stats.txt"))
+        open_s = time.perf_counter() - start
+        slow_repeat = max(3, iterations // 20)
+        results = {}
+
+        results["load_vocabulary_data"] = summarize(timed(lambda: session.select_table("vocabulary"), slow_repeat))
+        pack_file = os.path.join(tmp_dir, "deck.vpack")
+        write_pack(db_file, pack_file)
+        session.attach_pack(pack_file)
+        results["load_vocabulary_pack"] = summarize(timed(lambda: session.select_table("vocabulary"), slow_repeat))
+        results["pack_row"] = summarize(timed(lambda: tuple(session.next_word()), iterations))
+        session.select_table("vocab_exe")
+
+        session.review_mode = "sequence"
+        results["next_word_sequence"] = summarize(timed(session.next_word, iterations))
+        session.review_mode = "random"
+        results["next_word_random"] = summarize(timed(session.next_word, iterations))
+        session.review_mode = "weighted"
+        results["next_word_weighted"] = summarize(timed(session.next_word, iterations))
+        session.review_mode = "due"
+        results["next_word_due"] = summarize(timed(session.next_word, iterations))
+
+        session.review_mode = "sequence"
+        results["mark_known"] = summarize(timed(session.mark_known, iterations))
+        results["mark_new"] = summarize(timed(session.mark_new, iterations))
+
+        # Another window reviews a word, then this one picks it up
+        other = ReviewSession()
+        other.open(db_file, log_file=os.path.join(tmp_dir, "other_stats.txt"))
+        other.select_table("vocab_exe")
+
+        def sync_after_review():
+            other.mark_known()
+            start = time.perf_counter()
+            session.sync()
+            return time.perf_counter() - start
+
+        results["sync"] = summarize([sync_after_review() for _ in range(iterations)])
+        other.close()
+
+        def cold_counts():
+            session.repo.counts.clear()
+            session.table_counts()
+
+        queries = iter([f"mot{random.randrange(1, size + 1)}" for _ in range(iterations)])
+        results["search"] = summarize(timed(lambda: session.search(next(queries)), iterations))
+
+        results["table_counts_cold"] = summarize(timed(cold_counts, slow_repeat))
+        results["table_counts"] = summarize(timed(session.table_counts, iterations))
+        results["refresh_vocabulary"] = summarize(timed(session.refresh, iterations))
+        results["refresh_vocabulary_full"] = summarize(timed(lambda: session.refresh(full=True), slow_repeat))
+
+        today = datetime.date.today().isoformat()
+        word_ids = iter(range(1, iterations + 1))
+
+        def record_and_flush():
+            session.daily_stats.record(today, next(word_ids), "Y")
+            session.daily_stats.flush()
+
+        results["save_daily_stats"] = summarize(timed(record_and_flush, iterations))
+        session.close()
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+    return {"size": size, "deck_build_s": build_s, "open_s": open_s, "peak_rss_mb": peak_rss_mb, "operations": results}
+
+
+def print_results(runs, baseline=None):
+    previous = {}
+    for run in (baseline or {}).get("runs", []):
+        for name, stats in run["operations"].items():
+            previous[(run["size"], name)] = stats["p50_ms"]
+
+    for run in runs:
+        print(f"\n{run['size']} words (peak RSS {run['peak_rss_mb']:.1f} MB, deck built in {run['deck_build_s']:.1f} s, opened in {run['open_s']:.1f} s)")
+        print(f"  {'operation':<24} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}" + ("  vs baseline" if baseline else ""))
+        for name, stats in run["operations"].items():
+            line = f"  {name:<24} {stats['p50_ms']:>10.3f} {stats['p95_ms']:>10.3f} {stats['p99_ms']:>10.3f}"
+            old = previous.get((run["size"], name))
+            if old:
+                line += f"  {stats['p50_ms'] / old:>6.2f}x"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the review hot paths on synthetic decks.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="deck sizes in words")
+    parser.add_argument("--iterations", type=int, default=200, help="samples per fast operation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json", help="JSON file for the results")
+    parser.add_argument("--compare", help="earlier results file to compare p50 latencies against")
+    args = parser.parse_args()
+
+    runs = []
+    context = multiprocessing.get_context("spawn")
+    for size in args.sizes:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            runs.append(pool.submit(run_size, size, args.iterations, args.seed).result())
+        print(f"finished {size} words", file=sys.stderr)
+
+    results = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "iterations": args.iterations,
+        "runs": runs,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+    print_results(runs, baseline)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
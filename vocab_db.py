@@ -0,0 +1,796 @@
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+from vocab_trace import connection_factory
+
+# Tables the app manages; every other table in the file is only browsed
+VOCAB_TABLES = ["vocabulary", "vocab_exe", "known_vocab", "new_vocab"]
+
+# The lists are views over word_state, which holds one state per word.
+# A word taken off a list without joining another one is UNLISTED until the
+# next refresh puts it back into vocab_exe.
+WORD_STATES = {"vocab_exe": 0, "known_vocab": 1, "new_vocab": 2}
+STATE_TABLES = {state: table for table, state in WORD_STATES.items()}
+UNLISTED = 3
+
+# Deck layout version, kept in PRAGMA user_version:
+# 1: word_state and the list views, 2: UNLISTED, the state index and meta,
+# 3: the views expose word_state's id, so "ORDER BY id" walks the index,
+# 4: vocabulary_fts, 5: the word_state updated_at index, 6: word_state's
+# change counter, which sync reads instead, 7: state_counts
+DECK_VERSION = 7
+
+TEXT_COLUMNS = ["french_word", "english_translation", "example_sentence", "sentence_translation"]
+# bm25 weights of the text columns: a hit in the word itself ranks first
+SEARCH_WEIGHTS = {"french_word": 10.0, "english_translation": 5.0, "example_sentence": 1.0, "sentence_translation": 1.0}
+
+UNIX_NOW = "(julianday('now') - 2440587.5) * 86400.0"
+
+# Several windows, the explorers and the server may share one deck. In WAL
+# mode readers never wait for the writer; a writer waits up to
+# BUSY_TIMEOUT_MS for another one, and a write that still finds the deck
+# locked is retried WRITE_RETRIES times with exponential backoff.
+BUSY_TIMEOUT_MS = 5000
+WRITE_RETRIES = 5
+RETRY_DELAY = 0.05
+
+
+def connect_deck(db_file, **kwargs):
+    # With tracing on (vocab_trace) every statement is timed
+    conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT_MS / 1000, factory=connection_factory(), **kwargs)
+    # The journal mode is stored in the file, so only the first connection
+    # ever switches it; that needs a moment with no other connection open,
+    # and until then the deck keeps its rollback journal
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+    except sqlite3.OperationalError:
+        pass
+    # In WAL mode NORMAL is still safe against application crashes, and
+    # commits no longer wait for an fsync
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def is_busy(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def retry_write(write, *args):
+    # Runs a write transaction, again after a pause if the deck was locked
+    for attempt in range(WRITE_RETRIES + 1):
+        try:
+            return write(*args)
+        except sqlite3.OperationalError as e:
+            if not is_busy(e) or attempt == WRITE_RETRIES:
+                raise
+            time.sleep(RETRY_DELAY * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def default_file_mode():
+    # The mode open() would give a new file; mkstemp always uses 0600, so
+    # files written through it and renamed into place are set to this
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def text_columns(conn, table="vocabulary"):
+    # The TEXT_COLUMNS a deck actually has; older decks lack some of them
+    columns = set(table_columns(conn, table))
+    return [column for column in TEXT_COLUMNS if column in columns]
+
+
+def word_tables(conn):
+    # The tables a user can review: VOCAB_TABLES, then any other table or
+    # view with the columns of vocabulary. The deck's own bookkeeping
+    # (word_state, meta, reviews, the search index, ...) is left out.
+    kinds = conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view') ORDER BY name")
+    names = [row[0] for row in kinds]
+    if "vocabulary" not in names:
+        return []
+    layout = table_columns(conn, "vocabulary")
+    tables = [table for table in VOCAB_TABLES if table in names]
+    for name in names:
+        if name not in tables and not name.startswith("sqlite_") and table_columns(conn, name) == layout:
+            tables.append(name)
+    return tables
+
+
+class TableCounts:
+    # Word counts of a deck's word_tables() for the explorers, which redraw
+    # them after every commit to the deck. The lists are read from
+    # state_counts, and vocabulary is only counted again once words were
+    # added to it; nothing removes words from a deck.
+    def __init__(self):
+        self.counts = {}
+        self.max_id = None
+
+    def read(self, conn):
+        tables = word_tables(conn)
+        lists = None
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'state_counts'").fetchone():
+            lists = dict(conn.execute("SELECT state, words FROM state_counts"))
+        max_id = conn.execute("SELECT MAX(id) FROM vocabulary").fetchone()[0] if tables else None
+        counts = {}
+        for table in tables:
+            if lists is not None and table in WORD_STATES:
+                counts[table] = lists.get(WORD_STATES[table], 0)
+            elif table == "vocabulary" and max_id == self.max_id and table in self.counts:
+                counts[table] = self.counts[table]
+            else:
+                counts[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        self.counts = counts
+        self.max_id = max_id
+        return counts
+
+
+def migrate_deck(conn):
+    # Replaces the vocab_exe, known_vocab and new_vocab tables, which hold
+    # full copies of the vocabulary rows, with word_state plus views of the
+    # same names, and upgrades decks migrated by an earlier version. Each
+    # step runs once per deck in a single transaction; the INSTEAD OF
+    # triggers keep the older scripts that write to the lists working.
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= DECK_VERSION:
+        return
+    kinds = dict(conn.execute("SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view')"))
+    if kinds.get("vocabulary") != "table":
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another connection may have migrated the deck in the meantime
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= DECK_VERSION:
+            conn.rollback()
+            return
+        kinds = dict(conn.execute("SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view')"))
+        copied = "word_state" not in kinds
+        if copied:
+            _copy_lists(conn, kinds)
+        _create_views(conn)
+        conn.execute("CREATE INDEX IF NOT EXISTS word_state_state ON word_state (state, id)")
+        conn.execute("DROP INDEX IF EXISTS word_state_updated")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        _create_change_counter(conn)
+        _create_state_counts(conn)
+        _create_search_index(conn)
+        conn.execute(f"PRAGMA user_version = {DECK_VERSION}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    if copied:
+        # Give the space of the copied rows back
+        conn.execute("VACUUM")
+
+
+def _copy_lists(conn, kinds):
+    conn.execute("""
+        CREATE TABLE word_state (
+            id INTEGER PRIMARY KEY REFERENCES vocabulary (id),
+            state INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    now = time.time()
+    for table, state in WORD_STATES.items():
+        if kinds.get(table) != "table":
+            continue
+        # Keep listed words that are missing from vocabulary
+        conn.execute(f"""
+            INSERT OR IGNORE INTO vocabulary SELECT * FROM {table}
+            WHERE id IS NOT NULL AND id NOT IN (SELECT id FROM vocabulary)
+        """)
+        # A word found in several lists ends up in the last one copied
+        conn.execute(f"""
+            INSERT OR REPLACE INTO word_state (id, state, updated_at)
+            SELECT id, ?, ? FROM {table} WHERE id IN (SELECT id FROM vocabulary)
+        """, (state, now))
+        conn.execute(f"DROP TABLE {table}")
+
+
+def _create_change_counter(conn):
+    # Every insert into word_state and every change of a state takes the
+    # next number of the 'change' counter in meta. The triggers run inside
+    # the writer's transaction, so the numbers follow commit order whoever
+    # writes, and sync can ask for the rows past the last number it saw.
+    if "changed" not in table_columns(conn, "word_state"):
+        conn.execute("ALTER TABLE word_state ADD COLUMN changed INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS word_state_changed ON word_state (changed)")
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('change', 0)")
+    stamp = """
+        UPDATE meta SET value = value + 1 WHERE key = 'change';
+        UPDATE word_state SET changed = (SELECT value FROM meta WHERE key = 'change') WHERE id = NEW.id;
+    """
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS word_state_insert_changed AFTER INSERT ON word_state BEGIN {stamp} END")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS word_state_update_changed AFTER UPDATE OF state ON word_state BEGIN {stamp} END
+    """)
+
+
+def _create_state_counts(conn):
+    # The number of words in each state, kept by triggers, so counting a
+    # list reads one row instead of its part of the state index
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'state_counts'").fetchone():
+        return
+    conn.execute("CREATE TABLE state_counts (state INTEGER PRIMARY KEY, words INTEGER NOT NULL)")
+    conn.execute("INSERT INTO state_counts SELECT state, COUNT(*) FROM word_state GROUP BY state")
+    add = "INSERT INTO state_counts VALUES (NEW.state, 1) ON CONFLICT (state) DO UPDATE SET words = words + 1;"
+    remove = "UPDATE state_counts SET words = words - 1 WHERE state = OLD.state;"
+    conn.execute(f"CREATE TRIGGER word_state_insert_count AFTER INSERT ON word_state BEGIN {add} END")
+    conn.execute(f"""
+        CREATE TRIGGER word_state_update_count AFTER UPDATE OF state ON word_state
+        WHEN OLD.state IS NOT NEW.state BEGIN {remove} {add} END
+    """)
+    conn.execute(f"CREATE TRIGGER word_state_delete_count AFTER DELETE ON word_state BEGIN {remove} END")
+
+
+def _create_views(conn):
+    # The views have the columns of vocabulary, whichever those are
+    columns = "".join(f", v.{column}" for column in table_columns(conn, "vocabulary") if column != "id")
+    for table, state in WORD_STATES.items():
+        conn.execute(f"DROP VIEW IF EXISTS {table}")
+        conn.execute(f"""
+            CREATE VIEW {table} AS
+            SELECT s.id{columns}
+            FROM word_state s JOIN vocabulary v ON v.id = s.id
+            WHERE s.state = {state}
+        """)
+        # Adding a word to vocab_exe only takes it off UNLISTED, adding it to
+        # known_vocab or new_vocab moves it there
+        if table == "vocab_exe":
+            conflict = f"UPDATE SET state = excluded.state, updated_at = excluded.updated_at WHERE state = {UNLISTED}"
+        else:
+            conflict = "UPDATE SET state = excluded.state, updated_at = excluded.updated_at"
+        conn.execute(f"""
+            CREATE TRIGGER {table}_insert INSTEAD OF INSERT ON {table}
+            BEGIN
+                INSERT INTO word_state (id, state, updated_at) VALUES (NEW.id, {state}, {UNIX_NOW})
+                ON CONFLICT (id) DO {conflict};
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER {table}_delete INSTEAD OF DELETE ON {table}
+            BEGIN
+                UPDATE word_state SET state = {UNLISTED}, updated_at = {UNIX_NOW}
+                WHERE id = OLD.id AND state = {state};
+            END
+        """)
+
+
+def create_review_log(conn):
+    # The append-only log of every Y/N review, in the layout the explorer
+    # reads, and daily_aggregates, which triggers keep up to date so the
+    # stats read one row per day instead of scanning the log. Decks with a
+    # log from an earlier version get the indexes and their days filled in
+    # once, and a log in the explorer's older (date, word_id, known) layout
+    # is converted first.
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'daily_aggregates'").fetchone():
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'daily_aggregates'").fetchone():
+            conn.rollback()
+            return
+        legacy = table_columns(conn, "reviews")
+        if legacy and "ts" in legacy:
+            legacy = None
+        elif legacy:
+            conn.execute("ALTER TABLE reviews RENAME TO reviews_legacy")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS reviews (
+                id INTEGER PRIMARY KEY,
+                ts REAL NOT NULL,
+                date TEXT NOT NULL,
+                word_id INTEGER NOT NULL,
+                known TEXT NOT NULL
+            )
+        """)
+        if legacy:
+            _copy_legacy_reviews(conn, legacy)
+        # Covers every per-day query, so they never touch the table itself;
+        # it replaces the plain index on date
+        conn.execute("DROP INDEX IF EXISTS reviews_date")
+        conn.execute("CREATE INDEX IF NOT EXISTS reviews_date_word ON reviews (date, word_id, known)")
+        conn.execute("CREATE INDEX IF NOT EXISTS reviews_word ON reviews (word_id, ts)")
+        _create_daily_aggregates(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def _copy_legacy_reviews(conn, columns):
+    # The old log has no timestamps, so each review gets the start of its
+    # local day, and keeps its own id, or else its rowid, for the order
+    order = "id" if "id" in columns else "rowid"
+    conn.execute(f"""
+        INSERT INTO reviews (id, ts, date, word_id, known)
+        SELECT {order}, COALESCE((julianday(date, 'utc') - 2440587.5) * 86400.0, 0), date, word_id, known
+        FROM reviews_legacy
+        WHERE date IS NOT NULL AND word_id IS NOT NULL AND known IS NOT NULL
+        ORDER BY {order}
+    """)
+    conn.execute("DROP TABLE reviews_legacy")
+
+
+def _create_daily_aggregates(conn):
+    # Per day: reviewed counts every review, known and unknown the distinct
+    # words whose last mark that day was Y or N, and first_known and
+    # first_unknown the words marked Y or N for the first time ever, so their
+    # sums over all days are the distinct words ever marked so.
+    conn.execute("""
+        CREATE TABLE daily_aggregates (
+            date TEXT PRIMARY KEY,
+            reviewed INTEGER NOT NULL,
+            known INTEGER NOT NULL,
+            unknown INTEGER NOT NULL,
+            first_known INTEGER NOT NULL,
+            first_unknown INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        INSERT INTO daily_aggregates
+        SELECT d.date, d.reviewed,
+               COALESCE(l.known, 0), COALESCE(l.unknown, 0), COALESCE(f.known, 0), COALESCE(f.unknown, 0)
+        FROM (SELECT date, COUNT(*) AS reviewed FROM reviews GROUP BY date) d
+        LEFT JOIN (
+            SELECT date, SUM(known = 'Y') AS known, SUM(known = 'N') AS unknown FROM (
+                SELECT date, known, ROW_NUMBER() OVER (PARTITION BY date, word_id ORDER BY id DESC) AS n FROM reviews
+            ) WHERE n = 1 GROUP BY date
+        ) l USING (date)
+        LEFT JOIN (
+            SELECT date, SUM(known = 'Y') AS known, SUM(known = 'N') AS unknown FROM (
+                SELECT date, known, ROW_NUMBER() OVER (PARTITION BY word_id, known ORDER BY id) AS n FROM reviews
+            ) WHERE n = 1 GROUP BY date
+        ) f USING (date)
+    """)
+    # Each review only moves its word's mark for the day, found through the
+    # covering index, and checks the word's earlier reviews for a first mark
+    latest = """(SELECT known FROM reviews WHERE date = {row}.date AND word_id = {row}.word_id AND id < {row}.id
+                  ORDER BY id DESC LIMIT 1)"""
+    later = """NOT EXISTS (SELECT 1 FROM reviews WHERE date = OLD.date AND word_id = OLD.word_id AND id > OLD.id)"""
+    first = """NOT EXISTS (SELECT 1 FROM reviews WHERE word_id = {row}.word_id AND known = {row}.known AND id < {row}.id)"""
+    conn.execute(f"""
+        CREATE TRIGGER reviews_aggregate_insert AFTER INSERT ON reviews BEGIN
+            INSERT INTO daily_aggregates VALUES (NEW.date, 0, 0, 0, 0, 0) ON CONFLICT (date) DO NOTHING;
+            UPDATE daily_aggregates SET
+                reviewed = reviewed + 1,
+                known = known + (NEW.known = 'Y') - (previous.mark IS 'Y'),
+                unknown = unknown + (NEW.known = 'N') - (previous.mark IS 'N'),
+                first_known = first_known + (NEW.known = 'Y' AND {first.format(row="NEW")}),
+                first_unknown = first_unknown + (NEW.known = 'N' AND {first.format(row="NEW")})
+            FROM (SELECT {latest.format(row="NEW")} AS mark) AS previous
+            WHERE date = NEW.date;
+        END
+    """)
+    # Deleting a review undoes it: the word's day falls back to its previous
+    # mark, and a first mark passes on to the word's next review marked the same
+    conn.execute(f"""
+        CREATE TRIGGER reviews_aggregate_delete AFTER DELETE ON reviews BEGIN
+            UPDATE daily_aggregates SET
+                reviewed = reviewed - 1,
+                known = known - ((OLD.known = 'Y') - (previous.mark IS 'Y')) * ({later}),
+                unknown = unknown - ((OLD.known = 'N') - (previous.mark IS 'N')) * ({later}),
+                first_known = first_known - (OLD.known = 'Y' AND {first.format(row="OLD")}),
+                first_unknown = first_unknown - (OLD.known = 'N' AND {first.format(row="OLD")})
+            FROM (SELECT {latest.format(row="OLD")} AS mark) AS previous
+            WHERE date = OLD.date;
+            UPDATE daily_aggregates SET
+                first_known = first_known + (OLD.known = 'Y'),
+                first_unknown = first_unknown + (OLD.known = 'N')
+            WHERE {first.format(row="OLD")} AND date = (
+                SELECT date FROM reviews WHERE word_id = OLD.word_id AND known = OLD.known AND id > OLD.id
+                ORDER BY id LIMIT 1
+            );
+            DELETE FROM daily_aggregates WHERE date = OLD.date AND reviewed = 0;
+        END
+    """)
+
+
+def _create_search_index(conn):
+    # Full-text index over the vocabulary text, kept in sync by triggers.
+    # remove_diacritics folds accents, so "ecole" finds "école". Without
+    # FTS5 in this SQLite build, search falls back to LIKE. Only the text
+    # columns the deck has are indexed.
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'vocabulary_fts'").fetchone():
+        return
+    indexed = text_columns(conn)
+    if not indexed:
+        return
+    columns = ", ".join(indexed)
+    try:
+        conn.execute(f"""
+            CREATE VIRTUAL TABLE vocabulary_fts USING fts5 (
+                {columns}, content='vocabulary', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        if "fts5" not in str(e):
+            raise
+        return
+    new_values = ", ".join(f"new.{column}" for column in indexed)
+    old_values = ", ".join(f"old.{column}" for column in indexed)
+    conn.execute(f"""
+        CREATE TRIGGER vocabulary_fts_insert AFTER INSERT ON vocabulary BEGIN
+            INSERT INTO vocabulary_fts (rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER vocabulary_fts_delete AFTER DELETE ON vocabulary BEGIN
+            INSERT INTO vocabulary_fts (vocabulary_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER vocabulary_fts_update AFTER UPDATE ON vocabulary BEGIN
+            INSERT INTO vocabulary_fts (vocabulary_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO vocabulary_fts (rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    """)
+    conn.execute("INSERT INTO vocabulary_fts (vocabulary_fts) VALUES ('rebuild')")
+
+
+class VocabRepository:
+    def __init__(self, db_file, thread_local=False, write_behind=False, flush_every=20):
+        self.db_file = db_file
+        self.thread_local = thread_local
+        # With write_behind, transitions are queued and committed in batches
+        # by flush(); the caller also flushes on a timer and on close
+        self.write_behind = write_behind
+        self.flush_every = flush_every
+        self.pending = []
+        # Once sync_marks() is called, the ids of the reviews logged through
+        # this repository that changes_since() has not yet passed over
+        self.logged_reviews = None
+        # Row counts per table, read once with COUNT(*) and then kept up to
+        # date from the row counts of our own writes
+        self.counts = {}
+        self._local = threading.local()
+        self._conn = None
+        self._tables = None
+        self._word_tables = None
+        self._search_columns = None
+        self._sql = {}
+        self._data_version = None
+
+    @property
+    def conn(self):
+        # One long-lived connection, or one per thread when the repository
+        # is shared with worker threads
+        if self.thread_local:
+            conn = getattr(self._local, "conn", None)
+            if conn is None:
+                conn = self._local.conn = self._connect()
+            return conn
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def _connect(self):
+        conn = connect_deck(self.db_file, cached_statements=256)
+        migrate_deck(conn)
+        create_review_log(conn)
+        # Spaced-repetition state of every reviewed word, see vocab_scheduler
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schedule (
+                id INTEGER PRIMARY KEY,
+                interval REAL NOT NULL,
+                ease REAL NOT NULL,
+                reps INTEGER NOT NULL,
+                due_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS schedule_due ON schedule (due_at)")
+        conn.commit()
+        self._data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        return conn
+
+    def close(self):
+        self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def changed(self):
+        # True when another connection, such as a second window on the same
+        # deck, has committed since the last call; the cached counts and
+        # table names are dropped then. PRAGMA data_version reads no table,
+        # so this is cheap enough to poll.
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return False
+        self._data_version = version
+        self.counts.clear()
+        self._tables = None
+        self._word_tables = None
+        self._search_columns = None
+        return True
+
+    def tables(self):
+        if self._tables is None:
+            cursor = self.conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")
+            self._tables = [row[0] for row in cursor]
+        return self._tables
+
+    def word_tables(self):
+        if self._word_tables is None:
+            self._word_tables = word_tables(self.conn)
+        return self._word_tables
+
+    def statement(self, key, table, template):
+        # Table names cannot be bound as parameters, so build each SQL string
+        # once per table; reusing the same string keeps sqlite3's prepared
+        # statement cache warm
+        sql = self._sql.get((key, table))
+        if sql is None:
+            if table not in self.tables():
+                raise sqlite3.OperationalError(f"no such table: {table}")
+            sql = self._sql[(key, table)] = template.format(table=table)
+        return sql
+
+    def state(self, table):
+        # word_state code of a list view, None for any other table
+        if table in WORD_STATES and "word_state" in self.tables():
+            return WORD_STATES[table]
+        return None
+
+    def count(self, table):
+        # Queued transitions are reflected once they are flushed
+        if table not in self.counts:
+            self.flush()
+            state = self.state(table)
+            if state is not None:
+                cursor = self.conn.execute("SELECT COALESCE(SUM(words), 0) FROM state_counts WHERE state = ?",
+                                           (state,))
+            else:
+                cursor = self.conn.execute(self.statement("count", table, "SELECT COUNT(*) FROM {table}"))
+            self.counts[table] = cursor.fetchone()[0]
+        return self.counts[table]
+
+    def max_id(self, table):
+        self.flush()
+        sql = self.statement("max_id", table, "SELECT MAX(id) FROM {table}")
+        return self.conn.execute(sql).fetchone()[0]
+
+    def _adjust_count(self, table, delta):
+        if table in self.counts:
+            self.counts[table] += delta
+
+    def fetch_page(self, table, ids):
+        # The rows of the given ids, which the caller takes from the table's
+        # WordIndex. List rows are read from vocabulary, which queued moves
+        # never write, so a page read never has to flush them.
+        source = "vocabulary" if self.state(table) is not None else table
+        sql = self.statement(f"page{len(ids)}", source,
+                             "SELECT * FROM {table} WHERE id IN (" + ", ".join("?" * len(ids)) + ") ORDER BY id")
+        return self.conn.execute(sql, tuple(ids)).fetchall()
+
+    def fetch_ids(self, table, ordered=False):
+        self.flush()
+        if ordered:
+            sql = self.statement("ids_ordered", table, "SELECT id FROM {table} ORDER BY id")
+        else:
+            sql = self.statement("ids", table, "SELECT id FROM {table}")
+        return [row[0] for row in self.conn.execute(sql)]
+
+    def move_word(self, word_data, to_table, review=None, schedule=None):
+        # The word leaves whichever list it is in for to_table. review is an
+        # optional (ts, date, known) event logged with the move, schedule the
+        # word's new (interval, ease, reps, due_at). Returns True once the
+        # transition is committed, False while it is still waiting in the
+        # write-behind queue
+        self.pending.append((tuple(word_data), to_table, review, schedule))
+        if self.write_behind and len(self.pending) < self.flush_every:
+            return False
+        self.flush()
+        return True
+
+    def flush(self):
+        if not self.pending:
+            return
+        retry_write(self._write_pending)
+        self.pending = []
+
+    def _write_pending(self):
+        # Every queued transition goes into a single transaction, so a word is
+        # never left in two lists or in none. IMMEDIATE takes the write lock
+        # up front, where the busy timeout applies, instead of failing when
+        # the first read is upgraded to a write.
+        counts = dict(self.counts)
+        logged = []
+        try:
+            with self.conn:
+                self.conn.execute("BEGIN IMMEDIATE")
+                cursor = self.conn.cursor()
+                now = time.time()
+                for word_data, to_table, review, schedule in self.pending:
+                    self._apply_move(cursor, word_data, to_table, now)
+                    if review is not None:
+                        ts, date, known = review
+                        cursor.execute("INSERT INTO reviews (ts, date, word_id, known) VALUES (?, ?, ?, ?)",
+                                       (ts, date, word_data[0], known))
+                        logged.append(cursor.lastrowid)
+                    if schedule is not None:
+                        cursor.execute("INSERT OR REPLACE INTO schedule VALUES (?, ?, ?, ?, ?)",
+                                       (word_data[0],) + tuple(schedule))
+        except sqlite3.Error:
+            # Rolled back, so the counters go back as well
+            self.counts = counts
+            raise
+        if self.logged_reviews is not None:
+            self.logged_reviews.update(logged)
+
+    def _apply_move(self, cursor, word_data, to_table, now):
+        # A word has a single state, so joining to_table takes it out of
+        # whichever list it was in
+        state = WORD_STATES[to_table]
+        previous = cursor.execute("SELECT state FROM word_state WHERE id = ?", (word_data[0],)).fetchone()
+        if previous is not None and previous[0] == state:
+            return
+        cursor.execute("""
+            INSERT INTO word_state (id, state, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+        """, (word_data[0], state, now))
+        if previous is not None and previous[0] in STATE_TABLES:
+            self._adjust_count(STATE_TABLES[previous[0]], -1)
+        self._adjust_count(to_table, 1)
+
+    def fetch_schedule(self):
+        # In due order, read through the due_at index
+        self.flush()
+        cursor = self.conn.execute("SELECT id, interval, ease, reps, due_at FROM schedule ORDER BY due_at")
+        return cursor.fetchall()
+
+    def sync_marks(self):
+        # High-water marks of the deck: the latest word_state change, review
+        # and word, all read through their indexes
+        self.flush()
+        self.logged_reviews = set()
+        return tuple(self.conn.execute("""
+            SELECT (SELECT COALESCE(MAX(changed), 0) FROM word_state),
+                   (SELECT COALESCE(MAX(id), 0) FROM reviews),
+                   (SELECT COALESCE(MAX(id), 0) FROM vocabulary)
+        """).fetchone())
+
+    def changes_since(self, marks):
+        # What was committed after the sync_marks() marks, read from one
+        # snapshot: (id, state) of the words whose state changed, the
+        # (date, word_id, known) reviews logged by other connections, the
+        # schedule rows of the words reviewed, the ids of new words, and
+        # the new marks
+        self.flush()
+        changed, review_id, word_id = marks
+        self.conn.execute("BEGIN")
+        try:
+            states = self.conn.execute("SELECT id, state, changed FROM word_state WHERE changed > ?",
+                                       (changed,)).fetchall()
+            reviews = self.conn.execute("SELECT id, date, word_id, known FROM reviews WHERE id > ? ORDER BY id",
+                                        (review_id,)).fetchall()
+            schedule = self.conn.execute("""
+                SELECT id, interval, ease, reps, due_at FROM schedule
+                WHERE id IN (SELECT word_id FROM reviews WHERE id > ?)
+            """, (review_id,)).fetchall()
+            words = [row[0] for row in self.conn.execute("SELECT id FROM vocabulary WHERE id > ? ORDER BY id",
+                                                         (word_id,))]
+        finally:
+            self.conn.commit()
+        marks = (max([changed] + [row[2] for row in states]),
+                 reviews[-1][0] if reviews else review_id,
+                 words[-1] if words else word_id)
+        foreign = [row[1:] for row in reviews if row[0] not in self.logged_reviews]
+        self.logged_reviews = {review for review in self.logged_reviews if review > marks[1]}
+        return [row[:2] for row in states], foreign, schedule, words, marks
+
+    def search(self, query, limit=20):
+        # Best matches first as (id, french_word, english_translation). Every
+        # word of the query must match, the last one also as a prefix so
+        # results show up while typing.
+        terms = re.findall(r"\w+", query)
+        if not terms:
+            return []
+        self.flush()
+        if self._search_columns is None:
+            # The indexed columns, or for the LIKE fallback those of vocabulary
+            fts = "vocabulary_fts" in self.tables()
+            self._search_columns = fts, text_columns(self.conn, "vocabulary_fts" if fts else "vocabulary")
+        fts, columns = self._search_columns
+        if not columns:
+            return []
+        if fts:
+            match = " ".join(f'"{term}"' for term in terms[:-1]) + f' "{terms[-1]}"*'
+            weights = ", ".join(str(SEARCH_WEIGHTS[column]) for column in columns)
+            cursor = self.conn.execute(f"""
+                SELECT v.id, v.french_word, v.english_translation
+                FROM vocabulary_fts JOIN vocabulary v ON v.id = vocabulary_fts.rowid
+                WHERE vocabulary_fts MATCH ?
+                ORDER BY bm25(vocabulary_fts, {weights})
+                LIMIT ?
+            """, (match.strip(), limit))
+            return cursor.fetchall()
+        # Slow path for SQLite builds without FTS5
+        pattern = f"%{query.strip()}%"
+        where = " OR ".join(f"{column} LIKE ?" for column in columns)
+        cursor = self.conn.execute(f"""
+            SELECT id, french_word, english_translation FROM vocabulary
+            WHERE {where}
+            ORDER BY id LIMIT ?
+        """, (pattern,) * len(columns) + (limit,))
+        return cursor.fetchall()
+
+    def daily_totals(self, days=7):
+        # (date, reviewed, known, unknown) of the last days days with reviews,
+        # oldest first, read from daily_aggregates
+        self.flush()
+        cursor = self.conn.execute("""
+            SELECT * FROM (
+                SELECT date, reviewed, known, unknown FROM daily_aggregates ORDER BY date DESC LIMIT ?
+            ) ORDER BY date
+        """, (days,))
+        return cursor.fetchall()
+
+    def reviews_for_date(self, date):
+        self.flush()
+        cursor = self.conn.execute("SELECT word_id, known FROM reviews WHERE date = ? ORDER BY id", (date,))
+        return cursor.fetchall()
+
+    def clear_table(self, table):
+        self.flush()
+        retry_write(self._clear_table, table)
+        self.counts[table] = 0
+
+    def _clear_table(self, table):
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            state = self.state(table)
+            if state is not None:
+                self.conn.execute("UPDATE word_state SET state = ?, updated_at = ? WHERE state = ?",
+                                  (UNLISTED, time.time(), state))
+            else:
+                self.conn.execute(self.statement("clear", table, "DELETE FROM {table}"))
+
+    def refresh_exe(self, full=False):
+        # vocab_exe becomes every word that is neither known nor new. Only
+        # UNLISTED words and words added to vocabulary since the last refresh
+        # can be missing from it, so those are all an incremental refresh
+        # looks at; a full one checks every word in vocabulary. Returns the
+        # number of words put back into vocab_exe.
+        self.flush()
+        added = retry_write(self._refresh_exe, full)
+        self._adjust_count("vocab_exe", added)
+        return added
+
+    def _refresh_exe(self, full):
+        now = time.time()
+        exe = WORD_STATES["vocab_exe"]
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'refreshed_to'").fetchone()
+            refreshed_to = row[0] if row and not full else -1
+            cursor = self.conn.execute("UPDATE word_state SET state = ?, updated_at = ? WHERE state = ?",
+                                       (exe, now, UNLISTED))
+            added = cursor.rowcount
+            cursor = self.conn.execute("""
+                INSERT INTO word_state (id, state, updated_at)
+                SELECT v.id, ?, ? FROM vocabulary v
+                LEFT JOIN word_state s ON s.id = v.id
+                WHERE v.id > ? AND s.id IS NULL
+            """, (exe, now, refreshed_to))
+            added += cursor.rowcount
+            self.conn.execute("""
+                INSERT OR REPLACE INTO meta (key, value)
+                SELECT 'refreshed_to', COALESCE(MAX(id), -1) FROM vocabulary
+            """)
+        return added
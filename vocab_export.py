@@ -0,0 +1,240 @@
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from vocab_db import default_file_mode
+
+# What an export covers by default: the deck, the learner's lists and the
+# review history. Any other table or view can be named explicitly.
+EXPORT_TABLES = ["vocabulary", "known_vocab", "new_vocab", "reviews"]
+FORMATS = {"csv": ".csv", "jsonl": ".jsonl", "columns": ".columns.jsonl", "parquet": ".parquet"}
+COMPRESSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+CHUNK_ROWS = 10000
+# pyarrow and zstandard are optional and only imported when asked for
+MISSING_PYARROW = "Parquet export needs pyarrow: pip install pyarrow"
+MISSING_ZSTANDARD = "zstd compression needs zstandard: pip install zstandard"
+
+
+def output_name(table, fmt, compression):
+    # Parquet compresses its column chunks itself rather than the whole file
+    suffix = "" if fmt == "parquet" else COMPRESSIONS[compression]
+    return table + FORMATS[fmt] + suffix
+
+
+def open_deck(db_file):
+    # Read-only, so exporting neither migrates nor locks out the app's writes
+    # longer than each table's SELECT
+    return sqlite3.connect(f"file:{os.path.abspath(db_file)}?mode=ro", uri=True)
+
+
+def column_types(conn, table):
+    # Declared types of the columns, which views inherit from their tables
+    return [(row[1], (row[2] or "").upper()) for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+
+def read_chunks(conn, table, chunk_rows=CHUNK_ROWS):
+    # Yields lists of at most chunk_rows rows. sqlite3 steps the statement as
+    # rows are fetched, so only one chunk is ever held in memory.
+    order = " ORDER BY id" if "id" in [name for name, _ in column_types(conn, table)] else ""
+    cursor = conn.execute(f'SELECT * FROM "{table}"{order}')
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+def open_binary(path, compression):
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError(MISSING_ZSTANDARD)
+    raw = open(path, 'wb') if path != "-" else sys.stdout.buffer
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6, mtime=0), raw
+    if compression == "zstd":
+        return zstandard.ZstdCompressor().stream_writer(raw, closefd=False), raw
+    return raw, raw
+
+
+class TextSink:
+    # Text output compressed on the fly: the csv/jsonl writers write into the
+    # TextIOWrapper, which encodes into the compressor, which writes the file
+    def __init__(self, path, compression):
+        self.stream, self.raw = open_binary(path, compression)
+        self.text = io.TextIOWrapper(self.stream, encoding="utf-8", newline="", write_through=False)
+
+    def close(self):
+        self.text.flush()
+        self.text.detach()
+        if self.stream is not self.raw:
+            self.stream.close()
+        if self.raw is sys.stdout.buffer:
+            self.raw.flush()
+        else:
+            self.raw.close()
+
+
+def write_csv(sink, columns, chunks):
+    writer = csv.writer(sink.text)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(rows)
+
+
+def write_jsonl(sink, columns, chunks):
+    for rows in chunks:
+        sink.text.write("".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows))
+
+
+def write_columns(sink, columns, chunks):
+    # One JSON object per chunk holding a list per column, like a Parquet row
+    # group: {"rows": n, "columns": {"id": [...], "french_word": [...], ...}}
+    for rows in chunks:
+        data = {name: list(values) for name, values in zip(columns, zip(*rows))}
+        sink.text.write(json.dumps({"rows": len(rows), "columns": data}, ensure_ascii=False) + "\n")
+
+
+def arrow_schema(pa, types):
+    fields = []
+    for name, declared in types:
+        if "INT" in declared:
+            fields.append(pa.field(name, pa.int64()))
+        elif any(kind in declared for kind in ("REAL", "FLOA", "DOUB")):
+            fields.append(pa.field(name, pa.float64()))
+        else:
+            fields.append(pa.field(name, pa.string()))
+    return pa.schema(fields)
+
+
+def write_parquet(path, types, chunks, compression):
+    # Each chunk becomes one row group
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError(MISSING_PYARROW)
+    schema = arrow_schema(pa, types)
+    codec = {"none": "NONE", "gzip": "GZIP", "zstd": "ZSTD"}[compression]
+    with pq.ParquetWriter(path, schema, compression=codec) as writer:
+        for rows in chunks:
+            arrays = [pa.array(list(values), type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+
+def export_table(conn, table, path, fmt="csv", compression="none", chunk_rows=CHUNK_ROWS):
+    # Streams one table or view of an open deck to path ("-" for stdout) and
+    # returns the number of rows written. A file is written under a temporary
+    # name and renamed when complete.
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format: {fmt}")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"unknown compression: {compression}")
+    types = column_types(conn, table)
+    if not types:
+        raise ValueError(f"no such table: {table}")
+    columns = [name for name, _ in types]
+    counted = [0]
+
+    def chunks():
+        for rows in read_chunks(conn, table, chunk_rows):
+            counted[0] += len(rows)
+            yield rows
+
+    if path == "-":
+        if fmt == "parquet":
+            raise ValueError("parquet cannot be written to stdout")
+        tmp_file = "-"
+    else:
+        fd, tmp_file = tempfile.mkstemp(suffix=".part", dir=os.path.dirname(os.path.abspath(path)))
+        os.close(fd)
+    try:
+        if fmt == "parquet":
+            write_parquet(tmp_file, types, chunks(), compression)
+        else:
+            sink = TextSink(tmp_file, compression)
+            try:
+                {"csv": write_csv, "jsonl": write_jsonl, "columns": write_columns}[fmt](sink, columns, chunks())
+            finally:
+                sink.close()
+        if tmp_file != "-":
+            os.chmod(tmp_file, default_file_mode())
+            os.replace(tmp_file, path)
+    except BaseException:
+        if tmp_file != "-" and os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    return counted[0]
+
+
+def export_deck(db_file, out_dir, tables=None, fmt="csv", compression="none", chunk_rows=CHUNK_ROWS, progress=None):
+    # Exports each table into out_dir, one file per table. Default tables
+    # missing from the deck, like reviews in a deck the app never opened, are
+    # skipped. progress(table, path, rows) is called after each one.
+    # Returns {table: rows}.
+    os.makedirs(out_dir, exist_ok=True)
+    conn = open_deck(db_file)
+    exported = {}
+    try:
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+        for table in tables or EXPORT_TABLES:
+            if table not in existing and not tables:
+                continue
+            path = os.path.join(out_dir, output_name(table, fmt, compression))
+            exported[table] = export_table(conn, table, path, fmt, compression, chunk_rows)
+            if progress:
+                progress(table, path, exported[table])
+    finally:
+        conn.close()
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export deck tables and review history, streaming rows from SQLite.")
+    parser.add_argument("db_file", help="SQLite deck to export")
+    parser.add_argument("-o", "--output", default="export",
+                        help="output directory, or a file ('-' for stdout) when one table is given (default: export)")
+    parser.add_argument("--tables", help=f"comma separated tables to export (default: {','.join(EXPORT_TABLES)})")
+    parser.add_argument("--format", choices=list(FORMATS), default="csv",
+                        help="csv, jsonl (one object per row), columns (one JSON object of column lists per chunk) "
+                             "or parquet (needs pyarrow)")
+    parser.add_argument("--compression", choices=list(COMPRESSIONS), default="none",
+                        help="gzip, or zstd (needs zstandard)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="rows fetched and written at a time")
+    args = parser.parse_args()
+
+    tables = args.tables.split(",") if args.tables else None
+    single_file = tables and len(tables) == 1 and (args.output == "-" or os.path.splitext(args.output)[1])
+    started = time.perf_counter()
+
+    def report(table, path, rows):
+        print(f"Exported {rows} rows of {table} to {path} in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+    try:
+        if single_file:
+            conn = open_deck(args.db_file)
+            try:
+                rows = export_table(conn, tables[0], args.output, args.format, args.compression, args.chunk_rows)
+            finally:
+                conn.close()
+            report(tables[0], args.output, rows)
+        else:
+            export_deck(args.db_file, args.output, tables, args.format, args.compression, args.chunk_rows, report)
+    except (OSError, ValueError, RuntimeError, sqlite3.Error) as e:
+        print(f"Export failed: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+import argparse
+import csv
+import hashlib
+import html
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+import unicodedata
+
+from vocab_db import TEXT_COLUMNS, migrate_deck
+
+# The first columns of TEXT_COLUMNS, which may not be empty
+REQUIRED_COLUMNS = ["french_word", "english_translation"]
+FORMATS = {".csv": "csv", ".tsv": "tsv", ".tab": "tsv", ".txt": "anki"}
+# Values of Anki's "#separator:" header
+ANKI_SEPARATORS = {"tab": "\t", "comma": ",", "semicolon": ";", "pipe": "|", "space": " "}
+
+VOCABULARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vocabulary (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    french_word TEXT NOT NULL,
+    english_translation TEXT NOT NULL,
+    example_sentence TEXT NOT NULL,
+    sentence_translation TEXT NOT NULL
+)
+"""
+
+
+def word_key(french_word):
+    # 64-bit hash of the normalized word: same letters and accents, any case
+    # or spacing
+    normalized = " ".join(unicodedata.normalize("NFC", french_word).casefold().split())
+    return int.from_bytes(hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+class LineReader:
+    # Decoded lines of a file opened in binary mode, tracking the byte offset
+    # of the end of the last line handed out, so a record's end position is
+    # known and an import can resume from it
+    def __init__(self, f, offset=0):
+        self.f = f
+        self.offset = offset
+
+    def __iter__(self):
+        for raw in self.f:
+            self.offset += len(raw)
+            yield raw.decode("utf-8-sig" if self.offset == len(raw) else "utf-8")
+
+
+def read_anki_header(f):
+    # Anki's plain text export starts with "#key:value" lines
+    options = {}
+    offset = 0
+    for raw in f:
+        line = raw.decode("utf-8-sig" if offset == 0 else "utf-8").strip()
+        if not line.startswith("#") or ":" not in line:
+            break
+        key, value = line[1:].split(":", 1)
+        options[key.strip()] = value.strip()
+        offset += len(raw)
+    return options, offset
+
+
+def strip_html(text):
+    text = re.sub(r"<br\s*/?>", " ", text, flags=re.IGNORECASE)
+    return html.unescape(re.sub(r"<[^>]+>", "", text))
+
+
+def read_records(path, fmt, start=0):
+    # Yields (end offset, fields) for every record from byte offset start on
+    # (or from the first record, whichever is later)
+    with open(path, 'rb') as f:
+        delimiter = "\t" if fmt == "tsv" else ","
+        is_html = False
+        body = 0
+        if fmt == "anki":
+            options, body = read_anki_header(f)
+            delimiter = ANKI_SEPARATORS.get(options.get("separator", "tab").lower(), "\t")
+            is_html = options.get("html", "false").lower() == "true"
+        offset = max(start, body)
+        f.seek(offset)
+        lines = LineReader(f, offset)
+        quoting = csv.QUOTE_NONE if fmt == "tsv" else csv.QUOTE_MINIMAL
+        for fields in csv.reader(lines, delimiter=delimiter, quoting=quoting):
+            if is_html:
+                fields = [strip_html(field) for field in fields]
+            yield lines.offset, fields
+
+
+def validate(fields, positions):
+    # The vocabulary row for a record, or the reason it is rejected
+    count = len(fields)
+    row = tuple(fields[position].strip() if position is not None and position < count else ""
+                for position in map(positions.get, TEXT_COLUMNS))
+    for i, column in enumerate(TEXT_COLUMNS[:len(REQUIRED_COLUMNS)]):
+        if not row[i]:
+            return None, f"missing {column}"
+    return row, None
+
+
+def column_positions(columns):
+    # columns names the input fields in order; "-" skips a field
+    positions = {column: i for i, column in enumerate(columns) if column != "-"}
+    unknown = set(positions) - set(TEXT_COLUMNS)
+    if unknown:
+        raise ValueError(f"unknown columns: {', '.join(sorted(unknown))}")
+    for column in REQUIRED_COLUMNS:
+        if column not in positions:
+            raise ValueError(f"no field is mapped to {column}")
+    return positions
+
+
+def read_header(path, fmt, positions):
+    # A first row naming the columns maps the fields itself. Returns the
+    # positions to use and the offset of the first record after the header.
+    for offset, fields in read_records(path, fmt):
+        names = [field.strip().lower() for field in fields]
+        if "french_word" in names:
+            return column_positions([name if name in TEXT_COLUMNS else "-" for name in names]), offset
+        break
+    return positions, 0
+
+
+def prepare(conn):
+    conn.execute(VOCABULARY_SCHEMA)
+    conn.commit()
+    migrate_deck(conn)
+    # Settings for a bulk load; the checkpoint is committed with each batch,
+    # so an interrupted import resumes instead of starting over
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA cache_size = -65536")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.create_function("word_key", 1, word_key, deterministic=True)
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS vocabulary_keys (
+            hash INTEGER PRIMARY KEY,
+            id INTEGER NOT NULL
+        )
+    """)
+    # Words added since the last import, by the app or anything else
+    conn.execute("""
+        INSERT OR IGNORE INTO vocabulary_keys (hash, id)
+        SELECT word_key(french_word), id FROM vocabulary
+        WHERE id > (SELECT COALESCE(MAX(id), 0) FROM vocabulary_keys)
+        ORDER BY id
+    """)
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS import_batch (
+            seq INTEGER PRIMARY KEY,
+            hash INTEGER NOT NULL,
+            french_word TEXT NOT NULL,
+            english_translation TEXT NOT NULL,
+            example_sentence TEXT NOT NULL,
+            sentence_translation TEXT NOT NULL
+        )
+    """)
+    conn.commit()
+
+
+def next_id(conn):
+    # AUTOINCREMENT never reuses an id, so start past sqlite_sequence too
+    max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM vocabulary").fetchone()[0]
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'vocabulary'").fetchone()
+    return max(max_id, row[0] if row else 0) + 1
+
+
+def write_batch(conn, batch, first_id):
+    # Inserts the words of the batch that are not in the deck yet, and not
+    # repeated earlier in the batch, with ids from first_id on. Returns how
+    # many were inserted. The rows go in with set-based statements, which is
+    # several times faster than a row at a time through the FTS triggers.
+    unique = {}
+    for row in batch:
+        unique.setdefault(row[0], row)
+    conn.executemany("INSERT INTO import_batch (hash, french_word, english_translation, example_sentence, sentence_translation) VALUES (?, ?, ?, ?, ?)", unique.values())
+    conn.execute("DELETE FROM import_batch WHERE hash IN (SELECT hash FROM vocabulary_keys)")
+    cursor = conn.execute("""
+        INSERT INTO vocabulary (id, french_word, english_translation, example_sentence, sentence_translation)
+        SELECT ? + row_number() OVER (ORDER BY seq) - 1, french_word, english_translation, example_sentence, sentence_translation
+        FROM import_batch
+    """, (first_id,))
+    inserted = cursor.rowcount
+    conn.execute("""
+        INSERT INTO vocabulary_keys (hash, id)
+        SELECT hash, ? + row_number() OVER (ORDER BY seq) - 1 FROM import_batch
+    """, (first_id,))
+    conn.execute("DELETE FROM import_batch")
+    return inserted
+
+
+def checkpoint_key(path):
+    return f"import:{os.path.abspath(path)}"
+
+
+def load_checkpoint(conn, path):
+    # Byte offset to resume from, if an earlier import of the same,
+    # unchanged file was interrupted
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (checkpoint_key(path),)).fetchone()
+    if not row:
+        return None
+    checkpoint = json.loads(row[0])
+    stat = os.stat(path)
+    if checkpoint["size"] != stat.st_size or checkpoint["mtime"] != stat.st_mtime:
+        return None
+    return checkpoint
+
+
+def import_file(db_file, path, fmt=None, columns=None, batch_size=50000, resume=True, progress=None, rejects=None):
+    # Streams path into the vocabulary table of db_file, creating the deck if
+    # needed. progress(stats) is called after every batch; rejected records
+    # are written to the rejects csv writer with the reason. Returns the stats.
+    fmt = fmt or FORMATS.get(os.path.splitext(path)[1].lower(), "csv")
+    positions = column_positions(columns or TEXT_COLUMNS)
+    stat = os.stat(path)
+    stats = {"records": 0, "inserted": 0, "duplicates": 0, "rejected": 0, "bytes": 0, "total_bytes": stat.st_size}
+
+    conn = sqlite3.connect(db_file)
+    try:
+        prepare(conn)
+        start = 0
+        checkpoint = load_checkpoint(conn, path) if resume else None
+        if checkpoint:
+            start = checkpoint["offset"]
+            stats.update(checkpoint["stats"])
+
+        positions, body = read_header(path, fmt, positions)
+        start = max(start, body)
+
+        first_id = next_id(conn)
+        batch = []
+        offset = start
+        for offset, fields in read_records(path, fmt, start):
+            stats["records"] += 1
+            row, reason = validate(fields, positions)
+            if row is None:
+                stats["rejected"] += 1
+                if rejects is not None:
+                    rejects.writerow([reason] + fields)
+                continue
+            batch.append((word_key(row[0]),) + row)
+            if len(batch) >= batch_size:
+                first_id = _commit_batch(conn, path, stat, batch, first_id, offset, stats, progress)
+                batch = []
+        _commit_batch(conn, path, stat, batch, first_id, offset, stats, progress)
+
+        # Finished, so the next run of this file starts from the top
+        conn.execute("DELETE FROM meta WHERE key = ?", (checkpoint_key(path),))
+        conn.commit()
+    finally:
+        conn.close()
+    return stats
+
+
+def _commit_batch(conn, path, stat, batch, first_id, offset, stats, progress):
+    # One transaction per batch, together with the checkpoint
+    with conn:
+        inserted = write_batch(conn, batch, first_id) if batch else 0
+        stats["inserted"] += inserted
+        stats["duplicates"] += len(batch) - inserted
+        stats["bytes"] = offset
+        checkpoint = {"offset": offset, "size": stat.st_size, "mtime": stat.st_mtime, "stats": stats}
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (checkpoint_key(path), json.dumps(checkpoint)))
+    if progress:
+        progress(stats)
+    return first_id + inserted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import CSV, TSV or Anki text exports into a deck's vocabulary table.")
+    parser.add_argument("db_file", help="SQLite deck to import into (created if missing)")
+    parser.add_argument("input", help="file to import")
+    parser.add_argument("--format", choices=["csv", "tsv", "anki"], help="input format (default: from the file extension)")
+    parser.add_argument("--columns", help="comma separated target column of each field, '-' to skip one "
+                                          f"(default: {','.join(TEXT_COLUMNS)})")
+    parser.add_argument("--batch-size", type=int, default=50000, help="rows per transaction")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of an interrupted import")
+    parser.add_argument("--rejects", help="write rejected records with the reason to this CSV file")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+
+    def report(stats):
+        elapsed = time.perf_counter() - started
+        done = stats["bytes"] / stats["total_bytes"] * 100 if stats["total_bytes"] else 100
+        print(f"\r{done:5.1f}%  {stats['records']} records, {stats['inserted']} new, {stats['duplicates']} duplicates, "
+              f"{stats['rejected']} rejected ({stats['records'] / max(elapsed, 1e-9):.0f} records/s)", end="", file=sys.stderr)
+
+    rejects_file = open(args.rejects, 'w', newline='', encoding='utf-8') if args.rejects else None
+    try:
+        stats = import_file(args.db_file, args.input, fmt=args.format,
+                            columns=args.columns.split(",") if args.columns else None,
+                            batch_size=args.batch_size, resume=not args.restart, progress=report,
+                            rejects=csv.writer(rejects_file) if rejects_file else None)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"\nImport failed: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if rejects_file:
+            rejects_file.close()
+    print(f"\nImported {stats['inserted']} new words in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import bisect
+import random
+from array import array
+from collections import OrderedDict, deque
+
+
+class WordIndex:
+    # Sorted ids of the words still in the selected table, packed into an
+    # array so a large deck costs 8 bytes per word. ids must come in
+    # ascending order, as from "ORDER BY id"; an array of ids known to be
+    # unique is used as is.
+    def __init__(self, ids=(), unique=False):
+        if unique and isinstance(ids, array):
+            self.ids = ids
+        else:
+            self.ids = array('q')
+            for word_id in ids:
+                if not self.ids or word_id != self.ids[-1]:
+                    self.ids.append(word_id)
+        # Random picks are drawn ahead of time so the upcoming cards are known
+        self.drawn = deque()
+        # Built on the first random pick
+        self.deck = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, word_id):
+        i = bisect.bisect_left(self.ids, word_id)
+        return i < len(self.ids) and self.ids[i] == word_id
+
+    def first_id(self):
+        return self.ids[0] if self.ids else None
+
+    def next_id(self, word_id):
+        # Next larger id, wrapping around to the smallest one
+        if not self.ids:
+            return None
+        i = bisect.bisect_right(self.ids, word_id)
+        return self.ids[i] if i < len(self.ids) else self.ids[0]
+
+    def random_id(self):
+        # Every word once, in random order, before any word comes up again
+        while self.drawn:
+            word_id = self.drawn.popleft()
+            # Skip pre-drawn words that have left the table since
+            if word_id in self:
+                return word_id
+        return self._deal()
+
+    def _deal(self):
+        if self.deck is None:
+            self.deck = ShuffledDeck(self)
+        return self.deck.draw()
+
+    def upcoming(self, word_id, n):
+        # The next n ids in sequence order after word_id
+        if not self.ids:
+            return []
+        i = bisect.bisect_right(self.ids, word_id)
+        return [self.ids[(i + k) % len(self.ids)] for k in range(min(n, len(self.ids)))]
+
+    def upcoming_random(self, n):
+        # The next n random picks; random_id() will return them in this order
+        while len(self.drawn) < min(n, len(self.ids)):
+            self.drawn.append(self._deal())
+        return list(self.drawn)[:n]
+
+    def add(self, word_id):
+        if word_id not in self:
+            bisect.insort(self.ids, word_id)
+            if self.deck is not None:
+                self.deck.add(word_id)
+
+    def remove(self, word_id):
+        i = bisect.bisect_left(self.ids, word_id)
+        if i < len(self.ids) and self.ids[i] == word_id:
+            del self.ids[i]
+
+    def clear(self):
+        self.ids = array('q')
+        self.drawn.clear()
+        self.deck = None
+
+
+class ShuffledDeck:
+    # Deals the ids of a WordIndex in random order without repeats. Each
+    # draw swaps a random undealt id into place, one step of a Fisher-Yates
+    # shuffle, so a draw is O(1) and nothing is shuffled up front. Once all
+    # are dealt, the next round starts from the index's current ids and is
+    # shuffled the same way. Ids that left the table are skipped as they
+    # come up; one that left and came back may come up twice in a round.
+    def __init__(self, index):
+        self.index = index
+        self.order = array('q', index.ids)
+        self.dealt = 0
+
+    def add(self, word_id):
+        # Joins the undealt part of the round
+        self.order.append(word_id)
+
+    def draw(self):
+        while True:
+            if self.dealt == len(self.order):
+                if not self.index.ids:
+                    return None
+                self.order = array('q', self.index.ids)
+                self.dealt = 0
+            order = self.order
+            i = self.dealt
+            j = random.randrange(i, len(order))
+            order[i], order[j] = order[j], order[i]
+            self.dealt += 1
+            if order[i] in self.index:
+                return order[i]
+
+
+class FenwickTree:
+    # Prefix sums of integer weights with O(log n) updates and lookups;
+    # positions count from 0
+    def __init__(self, weights=()):
+        self.tree = array('q', [0])
+        self.tree.extend(weights)
+        # Linear-time build: every node passes its sum on to its parent
+        for i in range(1, len(self.tree)):
+            parent = i + (i & -i)
+            if parent < len(self.tree):
+                self.tree[parent] += self.tree[i]
+
+    def __len__(self):
+        return len(self.tree) - 1
+
+    def add(self, position, delta):
+        i = position + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, end):
+        # Sum of the weights at positions below end
+        total = 0
+        while end > 0:
+            total += self.tree[end]
+            end -= end & -end
+        return total
+
+    def append(self, weight):
+        # The new node covers the (i & -i) positions ending at it
+        i = len(self.tree)
+        self.tree.append(weight + self.prefix(i - 1) - self.prefix(i - (i & -i)))
+
+    def find(self, target):
+        # The position whose weight spans target, for 0 <= target < total
+        position = 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            nxt = position + step
+            if nxt < len(self.tree) and self.tree[nxt] <= target:
+                position = nxt
+                target -= self.tree[nxt]
+            step >>= 1
+        return position
+
+
+class WeightedPicker:
+    # Random ids of a WordIndex, each drawn with probability proportional to
+    # its weight, e.g. words marked "N" more often than the rest. Positions
+    # in the tree are those of the ids when the picker was built; words
+    # added later get new positions at the end, and a word that leaves the
+    # table keeps its position with weight 0. Draws and weight changes are
+    # O(log n). weights maps the ids that do not weigh default.
+    def __init__(self, index, weights=None, default=1):
+        self.ids = array('q', index.ids)
+        self.added = {}
+        self.weights = array('q', [default]) * len(self.ids)
+        for word_id, weight in (weights or {}).items():
+            position = self.position(word_id)
+            if position is not None:
+                self.weights[position] = weight
+        self.tree = FenwickTree(self.weights)
+        self.total = sum(self.weights)
+        self.drawn = deque()
+
+    def position(self, word_id):
+        i = bisect.bisect_left(self.ids, word_id, 0, len(self.ids) - len(self.added))
+        if i < len(self.ids) - len(self.added) and self.ids[i] == word_id:
+            return i
+        return self.added.get(word_id)
+
+    def set_weight(self, word_id, weight):
+        position = self.position(word_id)
+        if position is None:
+            if weight <= 0:
+                return
+            self.added[word_id] = len(self.ids)
+            self.ids.append(word_id)
+            self.weights.append(weight)
+            self.tree.append(weight)
+            delta = weight
+        else:
+            delta = weight - self.weights[position]
+            self.tree.add(position, delta)
+            self.weights[position] = weight
+        self.total += delta
+
+    def remove(self, word_id):
+        self.set_weight(word_id, 0)
+
+    def _draw(self):
+        if self.total <= 0:
+            return None
+        return self.ids[self.tree.find(random.randrange(self.total))]
+
+    def random_id(self):
+        while self.drawn:
+            word_id = self.drawn.popleft()
+            if self.weights[self.position(word_id)] > 0:
+                return word_id
+        return self._draw()
+
+    def upcoming(self, n):
+        # The next n picks; random_id() will return them in this order
+        while len(self.drawn) < n and self.total > 0:
+            self.drawn.append(self._draw())
+        return list(self.drawn)[:n]
+
+
+class RowWindow:
+    # Full rows of the selected table, read a page at a time around the
+    # requested id and kept in a small LRU. Which words are in the table is
+    # up to the index, so fetch_page(ids) only has to return the rows of
+    # those ids.
+    def __init__(self, fetch_page, index, page_size=100, max_rows=1000):
+        self.fetch_page = fetch_page
+        self.index = index
+        self.page_size = page_size
+        self.max_rows = max_rows
+        self.rows = OrderedDict()
+        self.pages = 0
+
+    def row(self, word_id):
+        # None when the word is no longer in the table
+        row = self.rows.get(word_id)
+        if row is None:
+            self._load_page(word_id)
+            row = self.rows.get(word_id)
+            if row is None:
+                return None
+        self.rows.move_to_end(word_id)
+        return row
+
+    def _load_page(self, word_id):
+        # Start a little before the word so stepping back is cached too
+        ids = self.index.ids
+        i = bisect.bisect_left(ids, word_id)
+        if i == len(ids) or ids[i] != word_id:
+            return
+        start = max(0, i - self.page_size // 4)
+        self.pages += 1
+        for row in self.fetch_page(ids[start:start + self.page_size]):
+            self.rows[row[0]] = row
+            self.rows.move_to_end(row[0])
+        while len(self.rows) > self.max_rows:
+            self.rows.popitem(last=False)
+
+    def clear(self):
+        self.rows.clear()
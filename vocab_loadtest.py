@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from vocab_bench import make_deck, summarize
+
+# What a simulated learner does per step, by weight: mostly answering cards,
+# sometimes skipping one or looking at the counts and stats like the app does
+ACTIONS = [("mark_y", 45), ("mark_n", 25), ("next", 15), ("tables", 10), ("stats", 5)]
+
+
+class Client:
+    # One keep-alive HTTP connection
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, payload=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.writer.write((f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                           f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode("latin-1") + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        close = False
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+            elif name.lower() == "connection" and value.strip().lower() == "close":
+                close = True
+        data = json.loads(await self.reader.readexactly(length)) if length else None
+        if close:
+            self.close()
+        return status, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+async def learner(name, host, port, deadline, results, think, ramp, rng):
+    client = Client(host, port)
+    actions, weights = zip(*ACTIONS)
+    base = f"/learners/{name}"
+    # Learners join over the ramp-up rather than all in the same instant
+    await asyncio.sleep(rng.uniform(0, ramp))
+    try:
+        for method, path, payload in [("POST", f"{base}/select", {"table": "vocab_exe"}),
+                                      ("POST", f"{base}/mode", {"mode": rng.choice(["sequence", "random"])})]:
+            # Turned away while the server is busy: back off and try again
+            while await timed(client, method, path, payload, "setup", results) != 200:
+                if time.monotonic() >= deadline:
+                    return
+                await asyncio.sleep(rng.uniform(0.1, 1))
+        while time.monotonic() < deadline:
+            action = rng.choices(actions, weights)[0]
+            if action == "mark_y":
+                await timed(client, "POST", f"{base}/mark", {"known": "Y"}, action, results)
+            elif action == "mark_n":
+                await timed(client, "POST", f"{base}/mark", {"known": "N"}, action, results)
+            elif action == "next":
+                await timed(client, "POST", f"{base}/next", {}, action, results)
+            elif action == "tables":
+                await timed(client, "GET", "/tables", None, action, results)
+            else:
+                await timed(client, "GET", f"{base}/stats", None, action, results)
+            if think:
+                await asyncio.sleep(max(0, min(rng.expovariate(1 / think), deadline - time.monotonic())))
+    finally:
+        client.close()
+
+
+async def timed(client, method, path, payload, action, results):
+    start = time.perf_counter()
+    try:
+        status, _ = await client.request(method, path, payload)
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+        client.close()
+        status = "error"
+    results.append((action, status, time.perf_counter() - start))
+    return status
+
+
+async def run_load(host, port, learners, duration, think, ramp, seed):
+    # learners is a range of learner numbers
+    results = []
+    deadline = time.monotonic() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(learner(f"learner{i}", host, port, deadline, results, think, ramp, random.Random(seed + i))
+                           for i in learners))
+    return results, time.perf_counter() - start
+
+
+def run_slice(host, port, learners, duration, think, ramp, seed):
+    return asyncio.run(run_load(host, port, learners, duration, think, ramp, seed))
+
+
+def run_processes(host, port, learners, processes, duration, think, ramp, seed):
+    # One event loop can only issue so many requests per second, so the
+    # learners are split over several client processes
+    slices = [range(i, learners, processes) for i in range(processes)]
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(processes, mp_context=context) as pool:
+        runs = list(pool.map(run_slice, *zip(*[(host, port, learners, duration, think, ramp, seed) for learners in slices])))
+    return [result for results, _ in runs for result in results], max(elapsed for _, elapsed in runs)
+
+
+def report(results, elapsed, learners):
+    completed = [result for result in results if result[1] == 200]
+    print(f"{learners} learners, {len(results)} requests in {elapsed:.1f} s: "
+          f"{len(completed) / elapsed:.0f} req/s answered with 200")
+    statuses = {}
+    for _, status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    print("  statuses: " + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str)))
+    print(f"  {'action':<8} {'n':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for action in ["all"] + [name for name, _ in ACTIONS]:
+        samples = [seconds for name, status, seconds in completed if action in ("all", name)]
+        if samples:
+            s = summarize(samples)
+            print(f"  {action:<8} {s['n']:>8} {s['p50_ms']:>8.2f} {s['p95_ms']:>8.2f} {s['p99_ms']:>8.2f} {s['max_ms']:>8.2f}")
+
+
+def start_server(db_file, pool_size):
+    # The server in its own process, so the client does not compete with it
+    # for the interpreter; returns the process and its port
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "vocab_server.py"),
+                               db_file, "--port", "0", "--pool-size", str(pool_size)],
+                              stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line:
+        server.wait()
+        raise RuntimeError("the server did not start")
+    return server, int(line.rsplit(":", 1)[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many learners against vocab_server.py and report "
+                                                 "requests/s and tail latency.")
+    parser.add_argument("--url", help="host:port of a running server (default: start one on a synthetic deck)")
+    parser.add_argument("--deck-size", type=int, default=10000, help="words in the synthetic deck")
+    parser.add_argument("--learners", type=int, default=300, help="simulated learners")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run")
+    parser.add_argument("--think", type=float, default=0.05, help="mean pause between a learner's requests in s, 0 for none")
+    parser.add_argument("--processes", type=int, default=min(4, os.cpu_count() or 1),
+                        help="client processes the learners are spread over")
+    parser.add_argument("--ramp", type=float, default=2, help="seconds over which the learners join")
+    parser.add_argument("--pool-size", type=int, default=4, help="reader threads of the started server")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = None
+    tmp_dir = None
+    try:
+        if args.url:
+            host, port = args.url.rsplit(":", 1)
+            port = int(port)
+        else:
+            tmp_dir = tempfile.TemporaryDirectory()
+            db_file = os.path.join(tmp_dir.name, "loadtest.db")
+            make_deck(db_file, args.deck_size, seed=args.seed)
+            server, port = start_server(db_file, args.pool_size)
+            host = "127.0.0.1"
+        results, elapsed = run_processes(host, port, args.learners, args.processes, args.duration, args.think,
+                                         args.ramp, args.seed)
+        report(results, elapsed, args.learners)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        if tmp_dir:
+            tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
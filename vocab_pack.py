@@ -0,0 +1,195 @@
+import argparse
+import bisect
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+from array import array
+
+from vocab_db import TEXT_COLUMNS, default_file_mode
+
+# A pack is a read-only, memory-mapped copy of a vocabulary table:
+#   header | ids (int64, ascending) | offsets (int64) | UTF-8 string heap
+# Row i's text column c (0-3) is heap[offsets[4 * i + c]:offsets[4 * i + c + 1]].
+# Opening one only maps the file, and processes reading the same pack share
+# its pages.
+MAGIC = b"VOCPACK1"
+VERSION = 1
+HEADER = struct.Struct("<8sIIqqq")
+
+
+def default_pack_file(db_file):
+    return os.path.splitext(db_file)[0] + ".vpack"
+
+
+def write_pack(db_file, pack_file=None, table="vocabulary"):
+    # Compiles the table into a pack next to the deck; the file is replaced
+    # atomically so a running app never maps a half-written pack
+    pack_file = pack_file or default_pack_file(db_file)
+    conn = sqlite3.connect(db_file)
+    ids = array('q')
+    offsets = array('q', [0])
+    heap_file = tempfile.TemporaryFile()
+    heap_size = 0
+    try:
+        cursor = conn.execute(f"SELECT id, {', '.join(TEXT_COLUMNS)} FROM {table} ORDER BY id")
+        for row in cursor:
+            if ids and row[0] == ids[-1]:
+                continue
+            ids.append(row[0])
+            for text in row[1:]:
+                data = (text or "").encode("utf-8")
+                heap_file.write(data)
+                heap_size += len(data)
+                offsets.append(heap_size)
+    finally:
+        conn.close()
+
+    fd, tmp_file = tempfile.mkstemp(suffix=".part", dir=os.path.dirname(os.path.abspath(pack_file)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(TEXT_COLUMNS), len(ids), ids[-1] if ids else 0, heap_size))
+            ids.tofile(f)
+            offsets.tofile(f)
+            heap_file.seek(0)
+            while True:
+                block = heap_file.read(1024 * 1024)
+                if not block:
+                    break
+                f.write(block)
+        os.chmod(tmp_file, default_file_mode())
+        os.replace(tmp_file, pack_file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+    finally:
+        heap_file.close()
+    return len(ids)
+
+
+class PackRow:
+    # One row of a pack, decoded on access. Indexes like the
+    # (id, french_word, english_translation, example_sentence,
+    # sentence_translation) tuples read from SQLite.
+    __slots__ = ("pack", "position")
+
+    def __init__(self, pack, position):
+        self.pack = pack
+        self.position = position
+
+    def __getitem__(self, column):
+        if column == 0:
+            return self.pack.ids[self.position]
+        return self.pack.text(self.position, column - 1)
+
+    def __len__(self):
+        return len(TEXT_COLUMNS) + 1
+
+    def __iter__(self):
+        for column in range(len(self)):
+            yield self[column]
+
+    def __repr__(self):
+        return f"PackRow{tuple(self)!r}"
+
+    @property
+    def id(self):
+        return self[0]
+
+    @property
+    def french_word(self):
+        return self[1]
+
+    @property
+    def english_translation(self):
+        return self[2]
+
+    @property
+    def example_sentence(self):
+        return self[3]
+
+    @property
+    def sentence_translation(self):
+        return self[4]
+
+
+class DeckPack:
+    def __init__(self, pack_file):
+        self.pack_file = pack_file
+        with open(pack_file, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, columns, self.count, self.max_id, heap_size = HEADER.unpack_from(self.mm)
+            if magic != MAGIC or version != VERSION or columns != len(TEXT_COLUMNS):
+                raise ValueError(f"not a vocabulary pack: {pack_file}")
+            ids_start = HEADER.size
+            offsets_start = ids_start + self.count * 8
+            self.heap_start = offsets_start + (self.count * len(TEXT_COLUMNS) + 1) * 8
+            if self.heap_start + heap_size != len(self.mm):
+                raise ValueError(f"truncated vocabulary pack: {pack_file}")
+            view = memoryview(self.mm)
+            self.id_bytes = view[ids_start:offsets_start]
+            self.ids = self.id_bytes.cast('q')
+            self.offsets = view[offsets_start:self.heap_start].cast('q')
+        except BaseException:
+            self.close()
+            raise
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        # Views into the map must go before it can be closed
+        for name in ("ids", "id_bytes", "offsets"):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+                setattr(self, name, None)
+        self.mm.close()
+
+    def matches(self, count, max_id):
+        # The pack is stale once the table's row count or largest id differ
+        return self.count == count and (self.max_id if self.count else None) == max_id
+
+    def id_array(self):
+        ids = array('q')
+        ids.frombytes(self.id_bytes)
+        return ids
+
+    def text(self, position, column):
+        i = position * len(TEXT_COLUMNS) + column
+        start = self.heap_start + self.offsets[i]
+        end = self.heap_start + self.offsets[i + 1]
+        return str(self.mm[start:end], "utf-8")
+
+    def row(self, word_id):
+        # None when the id is not in the pack
+        i = bisect.bisect_left(self.ids, word_id)
+        if i < self.count and self.ids[i] == word_id:
+            return PackRow(self, i)
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile a deck table into a memory-mapped pack.")
+    parser.add_argument("db_file", help="SQLite deck to read")
+    parser.add_argument("-o", "--output", help="pack file (default: the deck's name with .vpack)")
+    parser.add_argument("--table", default="vocabulary", help="table to pack (default: vocabulary)")
+    args = parser.parse_args()
+
+    pack_file = args.output or default_pack_file(args.db_file)
+    start = time.perf_counter()
+    try:
+        rows = write_pack(args.db_file, pack_file, args.table)
+    except sqlite3.Error as e:
+        print(f"Could not read {args.table} from {args.db_file}: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Packed {rows} words into {pack_file} ({os.path.getsize(pack_file) / 1024:.0f} KB) "
+          f"in {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
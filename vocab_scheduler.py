@@ -0,0 +1,140 @@
+import bisect
+import heapq
+
+from vocab_index import WordIndex
+
+DAY = 24 * 60 * 60
+# A forgotten word comes back within the same session
+RELEARN_DELAY = 10 * 60
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+# The Y/N buttons on SM-2's 0-5 answer quality scale
+QUALITY = {"Y": 4, "N": 1}
+
+
+def sm2(card, quality, now):
+    # Next (interval in days, ease, repetitions, due_at) of a card after an
+    # answer; card is None for a word that has never been scheduled
+    interval, ease, reps = card[:3] if card else (0, DEFAULT_EASE, 0)
+    ease = max(MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    if quality < 3:
+        return (0, ease, 0, now + RELEARN_DELAY)
+    reps += 1
+    if reps == 1:
+        interval = 1
+    elif reps == 2:
+        interval = 6
+    else:
+        interval = round(interval * ease)
+    return (interval, ease, reps, now + interval * DAY)
+
+
+class Scheduler:
+    # SM-2 state of every scheduled word, read once from the schedule table
+    # in due_at order
+    def __init__(self, rows=()):
+        self.cards = {row[0]: tuple(row[1:]) for row in rows}
+
+    def update(self, rows):
+        # Cards rescheduled elsewhere, as rows of the schedule table
+        for row in rows:
+            self.cards[row[0]] = tuple(row[1:])
+
+    def review(self, word_id, known, now):
+        card = sm2(self.cards.get(word_id), QUALITY[known], now)
+        self.cards[word_id] = card
+        return card
+
+    def due_queue(self, index):
+        # Queue over the words of one table, given its WordIndex
+        scheduled = [(card[3], word_id) for word_id, card in self.cards.items() if word_id in index]
+        return DueQueue(scheduled, index)
+
+
+class DueQueue:
+    # Min-heap of (due_at, id) for the scheduled words of a table; stale
+    # entries left by rescheduled or removed words are dropped when they reach
+    # the top. Words never reviewed are the table's other ids, taken from its
+    # WordIndex in id order, so they cost no memory here.
+    def __init__(self, scheduled=(), index=None):
+        self.heap = list(scheduled)
+        heapq.heapify(self.heap)
+        self.due = {word_id: due_at for due_at, word_id in self.heap}
+        self.index = index if index is not None else WordIndex()
+        # Every id below new_from has been scheduled
+        self.new_from = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, word_id):
+        return word_id in self.index
+
+    def push(self, word_id, due_at):
+        self.due[word_id] = due_at
+        heapq.heappush(self.heap, (due_at, word_id))
+
+    def add(self, word_id):
+        # A never reviewed word joining the table, whatever its id
+        if word_id not in self.due:
+            self.new_from = min(self.new_from, word_id)
+
+    def remove(self, word_id):
+        self.due.pop(word_id, None)
+
+    def clear(self):
+        self.heap = []
+        self.due = {}
+        self.new_from = 0
+
+    def _valid(self, entry):
+        due_at, word_id = entry
+        return self.due.get(word_id) == due_at
+
+    def _top(self):
+        while self.heap and not self._valid(self.heap[0]):
+            heapq.heappop(self.heap)
+
+    def _new_ids(self):
+        ids = self.index.ids
+        for i in range(bisect.bisect_left(ids, self.new_from), len(ids)):
+            if ids[i] not in self.due:
+                yield ids[i]
+
+    def next_id(self, now):
+        # Most overdue word first, then never reviewed words in id order;
+        # None when nothing is due yet
+        self._top()
+        if self.heap and self.heap[0][0] <= now:
+            return self.heap[0][1]
+        for word_id in self._new_ids():
+            self.new_from = word_id
+            return word_id
+        return None
+
+    def next_due_at(self):
+        self._top()
+        return self.heap[0][0] if self.heap else None
+
+    def upcoming(self, n, now, skip=None):
+        # The next n ids in due order without consuming them; heap entries
+        # popped to look ahead are pushed back
+        ids = []
+        popped = []
+        while self.heap and len(ids) < n:
+            entry = heapq.heappop(self.heap)
+            popped.append(entry)
+            if not self._valid(entry):
+                continue
+            if entry[0] > now:
+                break
+            if entry[1] != skip:
+                ids.append(entry[1])
+        for entry in popped:
+            heapq.heappush(self.heap, entry)
+        for word_id in self._new_ids():
+            if len(ids) >= n:
+                break
+            if word_id != skip:
+                ids.append(word_id)
+        return ids
@@ -0,0 +1,578 @@
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import unquote
+
+from vocab_db import STATE_TABLES, TEXT_COLUMNS, VOCAB_TABLES, WORD_STATES, VocabRepository, connect_deck
+from vocab_index import WordIndex
+from vocab_pack import DeckPack, default_pack_file
+from vocab_scheduler import Scheduler
+from vocab_session import TRANSITIONS
+
+# Review modes of a learner; "due" needs a queue per learner and is left to
+# the desktop app
+SERVER_MODES = ["sequence", "random"]
+WORD_COLUMNS = ["id"] + TEXT_COLUMNS
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 431: "Request Header Fields Too Large", 500: "Internal Server Error",
+           503: "Service Unavailable"}
+MAX_HEADER_LINES = 100
+MAX_BODY = 64 * 1024
+# How often the deck is checked for commits by other processes, in seconds
+CHANGE_POLL = 1.0
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Learner:
+    # Where one learner is in the deck and what they reviewed this session;
+    # the lists themselves are the deck's, shared by everyone
+    def __init__(self, name):
+        self.name = name
+        self.table = None
+        self.current_id = None
+        self.mode = "sequence"
+        self.reviewed = 0
+        self.known = set()
+        self.unknown = set()
+
+    def stats(self):
+        return {"reviewed": self.reviewed, "known": len(self.known), "unknown": len(self.unknown)}
+
+
+class ReviewServer:
+    # One deck served to many learners. Reads run on a bounded pool of
+    # threads with a connection each; every write goes through one writer
+    # task, which commits whatever has queued up in a single transaction.
+    # Requests beyond max_inflight, or writes beyond max_writes waiting for
+    # the writer, are turned away with 503 rather than queued without bound.
+    def __init__(self, db_file, pool_size=4, max_inflight=256, max_writes=1024, max_learners=10000,
+                 write_batch=256, row_cache=50000):
+        self.db_file = db_file
+        self.pool_size = pool_size
+        self.max_inflight = max_inflight
+        self.max_learners = max_learners
+        self.write_batch = write_batch
+        self.row_cache = row_cache
+        self.read_pool = concurrent.futures.ThreadPoolExecutor(pool_size, thread_name_prefix="vocab-read")
+        self.write_pool = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="vocab-write")
+        self.writes = asyncio.Queue(max_writes)
+        self.local = threading.local()
+        self.read_conns = []
+        self.repo = None
+        self.pack = None
+        self.scheduler = Scheduler()
+        # What _watch has seen of the deck, see VocabRepository.sync_marks
+        self.marks = None
+        self.counts = {}
+        self.tables = []
+        self.indexes = {}
+        self.loading = {}
+        self.rows = OrderedDict()
+        self.learners = OrderedDict()
+        self.inflight = 0
+        self.writer_task = None
+        self.watch_task = None
+        self.stats = {"requests": 0, "rejected": 0, "commits": 0, "writes": 0}
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        # The writer's repository migrates the deck and creates the review tables
+        self.repo = VocabRepository(self.db_file, write_behind=True, flush_every=self.write_batch + 1)
+        self.tables, self.counts, schedule, self.marks = await loop.run_in_executor(self.write_pool, self._open_writer)
+        self.scheduler = Scheduler(schedule)
+        pack_file = default_pack_file(self.db_file)
+        if os.path.exists(pack_file):
+            try:
+                pack = DeckPack(pack_file)
+                if pack.matches(self.counts["vocabulary"], await self.read(self._max_id)):
+                    self.pack = pack
+                else:
+                    pack.close()
+            except (OSError, ValueError):
+                pass
+        self.writer_task = asyncio.create_task(self._writer())
+        self.watch_task = asyncio.create_task(self._watch())
+
+    async def close(self):
+        for task in (self.watch_task, self.writer_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        loop = asyncio.get_running_loop()
+        if self.repo:
+            await loop.run_in_executor(self.write_pool, self.repo.close)
+        self.read_pool.shutdown()
+        self.write_pool.shutdown()
+        for conn in self.read_conns:
+            conn.close()
+        if self.pack:
+            self.pack.close()
+
+    def _open_writer(self):
+        marks = self.repo.sync_marks()
+        tables = self.repo.word_tables()
+        counts = {table: self.repo.count(table) for table in VOCAB_TABLES if table in tables}
+        return tables, counts, self.repo.fetch_schedule(), marks
+
+    # Reads
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = connect_deck(self.db_file, check_same_thread=False)
+            conn.execute("PRAGMA query_only = ON")
+            self.read_conns.append(conn)
+        return conn
+
+    async def read(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.read_pool, fn, *args)
+
+    def _max_id(self):
+        return self._conn().execute("SELECT MAX(id) FROM vocabulary").fetchone()[0]
+
+    def _fetch_ids(self, table):
+        return WordIndex(row[0] for row in self._conn().execute(f"SELECT id FROM {table} ORDER BY id"))
+
+    def _fetch_row(self, word_id):
+        return self._conn().execute("SELECT * FROM vocabulary WHERE id = ?", (word_id,)).fetchone()
+
+    def _today(self, date):
+        # The day's reviews, and how many distinct words were last marked
+        # known or new, as the desktop app counts them
+        row = self._conn().execute("SELECT reviewed, known, unknown FROM daily_aggregates WHERE date = ?",
+                                   (date,)).fetchone()
+        reviewed, known, unknown = row or (0, 0, 0)
+        return {"reviewed": reviewed, "known": known, "unknown": unknown}
+
+    async def index(self, table):
+        # The ids of a table, shared by every learner reviewing it and kept
+        # up to date by the writer. Loaded once; concurrent requests wait for
+        # the same load, and moves committed while it runs are replayed on it.
+        if table in self.indexes:
+            return self.indexes[table]
+        if table not in self.loading:
+            self.loading[table] = (asyncio.ensure_future(self.read(self._fetch_ids, table)), [])
+        load, moves = self.loading[table]
+        try:
+            index = await load
+        finally:
+            self.loading.pop(table, None)
+        if table not in self.indexes:
+            self.indexes[table] = index
+            for move in moves:
+                self._apply_to_indexes(move)
+        return self.indexes[table]
+
+    async def row(self, word_id):
+        if word_id is None:
+            return None
+        if self.pack:
+            return self.pack.row(word_id)
+        row = self.rows.get(word_id)
+        if row is None:
+            row = await self.read(self._fetch_row, word_id)
+            if row is None:
+                return None
+            self.rows[word_id] = row
+            while len(self.rows) > self.row_cache:
+                self.rows.popitem(last=False)
+        self.rows.move_to_end(word_id)
+        return row
+
+    # Writes
+
+    async def write(self, kind, *args):
+        if self.writes.full():
+            raise HTTPError(503, "too many writes waiting")
+        future = asyncio.get_running_loop().create_future()
+        self.writes.put_nowait((kind, args, future))
+        return await future
+
+    async def _writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = [await self.writes.get()]
+            # Group commit: everything queued meanwhile shares the transaction
+            while len(jobs) < self.write_batch and not self.writes.empty():
+                jobs.append(self.writes.get_nowait())
+            moves = [job for job in jobs if job[0] == "move"]
+            if moves:
+                try:
+                    counts = await loop.run_in_executor(self.write_pool, self._commit_moves, [args for _, args, _ in moves])
+                except sqlite3.Error as e:
+                    for _, _, future in moves:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    self.counts = counts
+                    self.stats["commits"] += 1
+                    self.stats["writes"] += len(moves)
+                    for _, args, future in moves:
+                        self._apply_to_indexes(args)
+                        if not future.done():
+                            future.set_result(None)
+            for kind, args, future in jobs:
+                if kind != "refresh":
+                    continue
+                try:
+                    added, counts = await loop.run_in_executor(self.write_pool, self._refresh)
+                except sqlite3.Error as e:
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                self.counts = counts
+                if added and "vocab_exe" in self.indexes:
+                    del self.indexes["vocab_exe"]
+                if not future.done():
+                    future.set_result(added)
+
+    async def _watch(self):
+        # A desktop app or script writing to the same deck: only what it
+        # changed is applied to the loaded indexes and the scheduler
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(CHANGE_POLL)
+            try:
+                changed = await loop.run_in_executor(self.write_pool, self._check_changes)
+            except sqlite3.Error:
+                continue
+            if changed:
+                self.tables, self.counts, (states, _, schedule, words, self.marks) = changed
+                self.scheduler.update(schedule)
+                for word_id, state in states:
+                    self._apply_state(word_id, state)
+                if words:
+                    for word_id in words:
+                        self._apply_to_indexes(((word_id,), (), "vocabulary"))
+                    # A table sync cannot follow is read again when next asked for
+                    for table in [table for table in self.indexes if table not in VOCAB_TABLES]:
+                        del self.indexes[table]
+                    # Words are only ever added, so a pack goes stale with new ones
+                    if self.pack and not self.pack.matches(self.counts["vocabulary"], await self.read(self._max_id)):
+                        self.pack.close()
+                        self.pack = None
+
+    def _check_changes(self):
+        if not self.repo.changed():
+            return None
+        changes = self.repo.changes_since(self.marks)
+        tables = self.repo.word_tables()
+        counts = {table: self.repo.count(table) for table in VOCAB_TABLES if table in tables and table != "vocabulary"}
+        counts["vocabulary"] = self.counts.get("vocabulary", 0) + len(changes[3])
+        return tables, counts, changes
+
+    def _commit_moves(self, moves):
+        for word_data, from_tables, to_table, review, card in moves:
+            self.repo.move_word(word_data, to_table, review, card)
+        try:
+            self.repo.flush()
+        except sqlite3.Error:
+            self.repo.pending = []
+            raise
+        return dict(self.repo.counts)
+
+    def _refresh(self):
+        added = self.repo.refresh_exe()
+        return added, dict(self.repo.counts)
+
+    def _apply_state(self, word_id, state):
+        # A word another process moved, replayed as a move into its list;
+        # UNLISTED words only leave theirs
+        to_table = STATE_TABLES.get(state)
+        from_tables = tuple(table for table in WORD_STATES if table != to_table)
+        self._apply_to_indexes(((word_id,), from_tables, to_table))
+
+    def _apply_to_indexes(self, move):
+        word_data, from_tables, to_table = move[:3]
+        for table in from_tables + (to_table,):
+            if table in self.loading:
+                self.loading[table][1].append(move)
+        for table in from_tables:
+            if table in self.indexes:
+                self.indexes[table].remove(word_data[0])
+        if to_table in self.indexes:
+            self.indexes[to_table].add(word_data[0])
+
+    # Operations
+
+    def learner(self, name):
+        learner = self.learners.get(name)
+        if learner is None:
+            learner = self.learners[name] = Learner(name)
+            # Forget the learners seen least recently
+            while len(self.learners) > self.max_learners:
+                self.learners.popitem(last=False)
+        self.learners.move_to_end(name)
+        return learner
+
+    async def word(self, learner):
+        row = await self.row(learner.current_id)
+        return dict(zip(WORD_COLUMNS, row)) if row is not None else None
+
+    async def select(self, learner, table):
+        if table not in self.tables:
+            raise HTTPError(404, f"no such table: {table}")
+        index = await self.index(table)
+        learner.table = table
+        learner.current_id = index.first_id()
+        return await self.word(learner)
+
+    async def next_word(self, learner):
+        if learner.table is None:
+            raise HTTPError(400, "no table selected")
+        index = await self.index(learner.table)
+        if learner.mode == "random":
+            next_id = index.random_id()
+        else:
+            next_id = index.next_id(learner.current_id if learner.current_id is not None else 0)
+        # The table is empty, keep showing the last word
+        if next_id is not None:
+            learner.current_id = next_id
+        return await self.word(learner)
+
+    async def mark(self, learner, known):
+        if not isinstance(known, str) or known not in TRANSITIONS:
+            raise HTTPError(400, "known must be Y or N")
+        row = await self.row(learner.current_id)
+        if row is None:
+            raise HTTPError(400, "no current word")
+        word_data = tuple(row)
+        from_tables, to_table = TRANSITIONS[known]
+        now = time.time()
+        card = self.scheduler.review(word_data[0], known, now)
+        await self.write("move", word_data, from_tables, to_table,
+                         (now, datetime.date.today().isoformat(), known), card)
+        learner.reviewed += 1
+        if known == "Y":
+            learner.known.add(word_data[0])
+            learner.unknown.discard(word_data[0])
+        else:
+            learner.unknown.add(word_data[0])
+            learner.known.discard(word_data[0])
+        reviewed = dict(zip(WORD_COLUMNS, word_data))
+        return {"reviewed": reviewed, "word": await self.next_word(learner)}
+
+    async def refresh(self, learner):
+        added = await self.write("refresh")
+        learner.reviewed = 0
+        learner.known.clear()
+        learner.unknown.clear()
+        if learner.table is not None:
+            learner.current_id = (await self.index(learner.table)).first_id()
+        return {"added": added, "word": await self.word(learner)}
+
+    async def learner_stats(self, learner):
+        today = datetime.date.today().isoformat()
+        return {"session": learner.stats(), "today": await self.read(self._today, today)}
+
+    # HTTP
+
+    async def dispatch(self, method, path, body):
+        parts = [unquote(part) for part in path.split("?", 1)[0].strip("/").split("/") if part]
+        if parts == ["tables"]:
+            expect(method, "GET")
+            return {"tables": [{"name": table, "count": self.counts.get(table)} for table in VOCAB_TABLES
+                               if table in self.tables]}
+        if parts == ["status"]:
+            expect(method, "GET")
+            return dict(self.stats, inflight=self.inflight, learners=len(self.learners),
+                        queued_writes=self.writes.qsize())
+        if len(parts) != 3 or parts[0] != "learners":
+            raise HTTPError(404, f"no such resource: {path}")
+        learner = self.learner(parts[1])
+        action = parts[2]
+        if action == "word":
+            expect(method, "GET")
+            return {"word": await self.word(learner)}
+        if action == "stats":
+            expect(method, "GET")
+            return await self.learner_stats(learner)
+        expect(method, "POST")
+        if action == "select":
+            return {"word": await self.select(learner, text_field(body, "table"))}
+        if action == "mode":
+            if text_field(body, "mode") not in SERVER_MODES:
+                raise HTTPError(400, f"mode must be one of {', '.join(SERVER_MODES)}")
+            learner.mode = body["mode"]
+            return {"word": await self.next_word(learner)}
+        if action == "next":
+            return {"word": await self.next_word(learner)}
+        if action == "mark":
+            return await self.mark(learner, text_field(body, "known"))
+        if action == "refresh":
+            return await self.refresh(learner)
+        raise HTTPError(404, f"no such action: {action}")
+
+    async def respond(self, method, path, body):
+        self.stats["requests"] += 1
+        if self.inflight >= self.max_inflight:
+            self.stats["rejected"] += 1
+            return 503, {"error": "server busy"}
+        self.inflight += 1
+        try:
+            try:
+                payload = json.loads(body) if body else {}
+            except ValueError:
+                raise HTTPError(400, "body is not JSON")
+            if not isinstance(payload, dict):
+                raise HTTPError(400, "body must be a JSON object")
+            return 200, await self.dispatch(method, path, payload)
+        except HTTPError as e:
+            if e.status == 503:
+                self.stats["rejected"] += 1
+            return e.status, {"error": str(e)}
+        except sqlite3.Error as e:
+            return 500, {"error": f"database error: {e}"}
+        finally:
+            self.inflight -= 1
+
+    async def handle(self, reader, writer):
+        # HTTP/1.1 with keep-alive, one request at a time per connection
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HTTPError as e:
+                    send(writer, e.status, {"error": str(e)}, close=True)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, payload = await self.respond(method, path, body)
+                close = headers.get("connection", "").lower() == "close"
+                send(writer, status, payload, close=close, retry=status == 503)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            # A request nothing above expected still gets an answer
+            try:
+                send(writer, 500, {"error": f"internal error: {e}"}, close=True)
+                await writer.drain()
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+
+def expect(method, allowed):
+    if method != allowed:
+        raise HTTPError(405, f"use {allowed}")
+
+
+def text_field(body, name):
+    # A string field of a JSON body, or None when it is missing
+    value = body.get(name)
+    if value is not None and not isinstance(value, str):
+        raise HTTPError(400, f"{name} must be a string")
+    return value
+
+
+async def read_line(reader, status, message):
+    # StreamReader.readline raises ValueError for a line over its limit
+    try:
+        return await reader.readline()
+    except ValueError:
+        raise HTTPError(status, message)
+
+
+async def read_request(reader):
+    # (method, path, headers, body), or None once the client hangs up
+    line = await read_line(reader, 400, "request line too long")
+    if not line:
+        return None
+    try:
+        method, path, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "malformed request line")
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await read_line(reader, 431, "header line too long")
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HTTPError(400, "too many headers")
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "malformed Content-Length")
+    if length < 0:
+        raise HTTPError(400, "malformed Content-Length")
+    if length > MAX_BODY:
+        raise HTTPError(413, "body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+def send(writer, status, payload, close=False, retry=False):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", "Content-Type: application/json; charset=utf-8",
+            f"Content-Length: {len(body)}"]
+    if retry:
+        head.append("Retry-After: 1")
+    if close:
+        head.append("Connection: close")
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+
+
+async def serve(db_file, host="127.0.0.1", port=8765, ready=None, **options):
+    server = ReviewServer(db_file, **options)
+    await server.start()
+    listener = await asyncio.start_server(server.handle, host, port, backlog=1024)
+    address = listener.sockets[0].getsockname()
+    if ready:
+        ready(address)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a deck over HTTP/JSON to many learners on this machine.")
+    parser.add_argument("db_file", help="SQLite deck to serve")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on, 0 for any free port")
+    parser.add_argument("--pool-size", type=int, default=4, help="reader threads, each with its own connection")
+    parser.add_argument("--max-inflight", type=int, default=256, help="requests handled at once before answering 503")
+    parser.add_argument("--max-writes", type=int, default=1024, help="writes waiting for the writer before answering 503")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db_file):
+        print(f"No such deck: {args.db_file}", file=sys.stderr)
+        sys.exit(1)
+
+    def ready(address):
+        print(f"Serving {args.db_file} on http://{address[0]}:{address[1]}", flush=True)
+
+    try:
+        asyncio.run(serve(args.db_file, args.host, args.port, ready, pool_size=args.pool_size,
+                          max_inflight=args.max_inflight, max_writes=args.max_writes))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
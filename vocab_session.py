@@ -0,0 +1,356 @@
+import datetime
+import os
+import time
+
+from vocab_db import VocabRepository, VOCAB_TABLES, WORD_STATES
+from vocab_index import WordIndex, RowWindow, WeightedPicker
+from vocab_pack import DeckPack, default_pack_file
+from vocab_scheduler import Scheduler, DueQueue
+from vocab_stats import DailyStats
+
+REVIEW_MODES = ["sequence", "random", "weighted", "due"]
+# In weighted mode a word in new_vocab comes up this many times as often as
+# any other word
+NEW_WORD_WEIGHT = 4
+
+# For each answer: the tables the word leaves and the table it joins
+TRANSITIONS = {
+    "Y": (("new_vocab", "vocab_exe"), "known_vocab"),
+    "N": (("known_vocab", "vocab_exe"), "new_vocab"),
+}
+
+
+class ReviewSession:
+    # The review logic without any GUI: the open deck, the selected table,
+    # the current card, word transitions and statistics. VocabularyApp is a
+    # view over a session, and benchmarks or batch jobs can drive one directly.
+    def __init__(self, write_behind=False, flush_every=20):
+        self.write_behind = write_behind
+        self.flush_every = flush_every
+        self.db_file = None
+        self.repo = None
+        self.pack = None
+        self.current_table = None
+        self.current_id = None
+        self.word_index = WordIndex()
+        self.rows = RowWindow(lambda ids: [], self.word_index)
+        self.scheduler = Scheduler()
+        self.due_queue = DueQueue()
+        self.picker = None
+        # What sync() has seen of the deck, see VocabRepository.sync_marks
+        self.marks = None
+        self.review_mode = "sequence"
+        self.daily_stats = DailyStats()
+
+    def open(self, db_file, log_file=None):
+        # The stats file defaults to vocab_stats.txt next to the deck
+        # Raises ValueError for a file without a vocabulary table, and leaves
+        # no deck open when opening fails
+        self.close()
+        self.db_file = db_file
+        self.repo = VocabRepository(db_file, write_behind=self.write_behind, flush_every=self.flush_every)
+        self.current_table = None
+        self.current_id = None
+        self.word_index = WordIndex()
+        self.rows = RowWindow(lambda ids: [], self.word_index)
+        try:
+            if "word_state" not in self.repo.tables():
+                raise ValueError(f"{db_file} is not a vocabulary deck: it has no vocabulary table")
+            self.marks = self.repo.sync_marks()
+            self.scheduler = Scheduler(self.repo.fetch_schedule())
+            self.due_queue = DueQueue()
+            self.attach_pack(default_pack_file(db_file))
+            self.load_daily_stats(log_file or os.path.join(os.path.dirname(db_file), "vocab_stats.txt"))
+        except BaseException:
+            self.close()
+            raise
+
+    def attach_pack(self, pack_file):
+        # Serve the vocabulary table from a pack built by vocab_pack.py, as
+        # long as it still matches the deck
+        if self.pack:
+            self.pack.close()
+            self.pack = None
+        if not os.path.exists(pack_file):
+            return False
+        try:
+            pack = DeckPack(pack_file)
+        except (OSError, ValueError):
+            return False
+        if not pack.matches(self.repo.count("vocabulary"), self.repo.max_id("vocabulary")):
+            pack.close()
+            return False
+        self.pack = pack
+        return True
+
+    def close(self):
+        self.daily_stats.flush()
+        if self.repo:
+            # close() flushes any queued transitions first
+            self.repo.close()
+            self.repo = None
+        if self.pack:
+            self.pack.close()
+            self.pack = None
+
+    def load_daily_stats(self, log_file=None):
+        self.daily_stats = DailyStats(log_file)
+        self.daily_stats.load()
+        if self.repo:
+            self.seed_daily_stats()
+
+    def seed_daily_stats(self):
+        # The recent days are read from daily_aggregates, one row each. Today
+        # is rebuilt from its reviews, including earlier sessions, for the
+        # per-word marks that later reviews today are counted against.
+        self.daily_stats.merge(self.repo.daily_totals(self.daily_stats.days))
+        today = datetime.date.today().isoformat()
+        self.daily_stats.seed(today, self.repo.reviews_for_date(today))
+
+    def sync(self):
+        # Picks up commits made to the deck by another window, an explorer
+        # or the server. Only what changed since the last sync is read and
+        # applied to the selected table's ids, the due queue, the weighted
+        # picker and today's totals, so the shuffled deck carries on.
+        # Returns False, at the cost of one PRAGMA, when nothing changed.
+        if not self.repo or not self.repo.changed():
+            return False
+        states, reviews, schedule, words, self.marks = self.repo.changes_since(self.marks)
+        dropped = False
+        # Words are only ever added to a deck, so a pack goes stale with new ones
+        if self.pack and words and not self.pack.matches(self.repo.count("vocabulary"), self.repo.max_id("vocabulary")):
+            self.pack.close()
+            self.pack = None
+            dropped = True
+        self.scheduler.update(schedule)
+        table = self.current_table
+        if table is not None:
+            if (table == "vocabulary" and dropped) or (table != "vocabulary" and table not in WORD_STATES):
+                # Served from a pack that is out of date, or a table sync cannot follow
+                self.load_vocabulary_data()
+            else:
+                self.apply_changes(states, schedule, words)
+            # A current word taken off this table elsewhere gives way to the next one
+            if self.current_id is not None and self.current_id not in self.word_index:
+                self.current_id = self.word_index.next_id(self.current_id)
+        today = datetime.date.today().isoformat()
+        for date, word_id, known in reviews:
+            if date == today:
+                self.daily_stats.record(date, word_id, known)
+        if any(date != today for date, word_id, known in reviews):
+            self.daily_stats.merge(self.repo.daily_totals(self.daily_stats.days))
+        return True
+
+    def apply_changes(self, states, schedule, words):
+        # Changes read by sync(): (id, state) of the words that changed
+        # state, schedule rows and the ids of new words
+        states = dict(states)
+        table_state = WORD_STATES.get(self.current_table)
+        if table_state is None:
+            # vocabulary keeps every word and gains the new ones
+            members = dict.fromkeys(words, True)
+        else:
+            members = {word_id: state == table_state for word_id, state in states.items()}
+        for word_id, member in members.items():
+            if member:
+                self.word_index.add(word_id)
+            else:
+                self.word_index.remove(word_id)
+
+        for word_id in set(members) | set(states) | {row[0] for row in schedule}:
+            if word_id not in self.word_index:
+                self.due_queue.remove(word_id)
+                if self.picker:
+                    self.picker.remove(word_id)
+                continue
+            card = self.scheduler.cards.get(word_id)
+            if card is None:
+                self.due_queue.add(word_id)
+            elif self.due_queue.due.get(word_id) != card[3]:
+                self.due_queue.push(word_id, card[3])
+            if self.picker and (word_id in members or word_id in states):
+                self.picker.set_weight(word_id, self.word_weight(states.get(word_id) == WORD_STATES["new_vocab"]))
+
+    def tables(self):
+        return self.repo.word_tables()
+
+    def table_counts(self, tables=VOCAB_TABLES):
+        return [(table_name, self.repo.count(table_name)) for table_name in tables]
+
+    def select_table(self, table_name):
+        self.current_table = table_name
+        self.load_vocabulary_data()
+        self.current_id = self.word_index.first_id()
+        return self.current_word()
+
+    def load_vocabulary_data(self):
+        # Only the ids are loaded; rows are read in pages as cards are shown
+        table = self.current_table
+        if table == "vocabulary" and self.pack:
+            self.word_index = WordIndex(self.pack.id_array(), unique=True)
+            self.rows = self.pack
+        else:
+            self.word_index = WordIndex(self.repo.fetch_ids(table, ordered=True))
+            self.rows = RowWindow(lambda ids: self.repo.fetch_page(table, ids), self.word_index)
+        self.due_queue = self.scheduler.due_queue(self.word_index)
+        self.picker = None
+
+    def weighted_picker(self):
+        # Built on the first weighted pick from the table
+        if self.picker is None:
+            weights = {}
+            if self.word_weight(True) != 1:
+                weights = dict.fromkeys(self.repo.fetch_ids("new_vocab"), self.word_weight(True))
+            self.picker = WeightedPicker(self.word_index, weights)
+        return self.picker
+
+    def word_weight(self, in_new_vocab):
+        # Weighted mode favours new_vocab words over the rest of the table;
+        # within new_vocab itself every word weighs the same
+        if in_new_vocab and self.current_table != "new_vocab":
+            return NEW_WORD_WEIGHT
+        return 1
+
+    def has_words(self):
+        return len(self.word_index) > 0
+
+    def current_word(self):
+        # None also while nothing is due in "due" mode
+        if self.current_id is None:
+            return None
+        return self.rows.row(self.current_id)
+
+    def search(self, query, limit=20):
+        return self.repo.search(query, limit)
+
+    def jump_to(self, word_id):
+        # Show a given word, e.g. a search hit. A word that is not in the
+        # selected table is shown from vocabulary instead.
+        if word_id not in self.word_index:
+            self.select_table("vocabulary")
+        if word_id in self.word_index:
+            self.current_id = word_id
+        return self.current_word()
+
+    def set_review_mode(self, mode):
+        if mode not in REVIEW_MODES:
+            raise ValueError(f"unknown review mode: {mode}")
+        self.review_mode = mode
+        return self.next_word()
+
+    def next_word(self):
+        if self.current_table is None:
+            return None
+        if self.review_mode == "sequence":
+            # Next smallest id greater than the current one, wrapping around
+            next_id = self.word_index.next_id(self.current_id if self.current_id is not None else 0)
+        elif self.review_mode == "due":
+            next_id = self.due_queue.next_id(time.time())
+            if next_id is None:
+                # Nothing to review until the next word falls due
+                self.current_id = None
+                return None
+        elif self.review_mode == "weighted":
+            next_id = self.weighted_picker().random_id()
+            # Draws are independent, so try once more rather than repeat a card
+            if next_id == self.current_id and len(self.word_index) > 1:
+                next_id = self.picker.random_id()
+        else:
+            # Shuffled: every word once before any word comes up again
+            next_id = self.word_index.random_id()
+
+        # The table is empty, keep showing the last word
+        if next_id is not None:
+            self.current_id = next_id
+        return self.current_word()
+
+    def upcoming(self, n):
+        # The next n cards in review order, without moving to them
+        word_data = self.current_word()
+        if word_data is None:
+            return []
+        if self.review_mode == "sequence":
+            ids = self.word_index.upcoming(word_data[0], n)
+        elif self.review_mode == "due":
+            ids = self.due_queue.upcoming(n, time.time(), skip=word_data[0])
+        elif self.review_mode == "weighted":
+            ids = self.weighted_picker().upcoming(n)
+        else:
+            ids = self.word_index.upcoming_random(n)
+        rows = [self.rows.row(word_id) for word_id in ids]
+        return [row for row in rows if row is not None]
+
+    def mark_known(self):
+        return self.mark("Y")
+
+    def mark_new(self):
+        return self.mark("N")
+
+    def mark(self, known):
+        # Moves the current word, logs the review and advances to the next
+        # card. Returns the reviewed word.
+        word_data = self.current_word()
+        if word_data is None:
+            return None
+        from_tables, to_table = TRANSITIONS[known]
+        now = time.time()
+        today = datetime.date.today().isoformat()
+        card = self.scheduler.review(word_data[0], known, now)
+        self.repo.move_word(word_data, to_table, (now, today, known), card)
+
+        # Keep the navigation index and due queue in step with the selected table
+        if self.current_table in from_tables:
+            self.word_index.remove(word_data[0])
+        elif self.current_table == to_table:
+            self.word_index.add(word_data[0])
+        if word_data[0] in self.word_index:
+            self.due_queue.push(word_data[0], card[3])
+        else:
+            self.due_queue.remove(word_data[0])
+        if self.picker:
+            if word_data[0] in self.word_index:
+                self.picker.set_weight(word_data[0], self.word_weight(to_table == "new_vocab"))
+            else:
+                self.picker.remove(word_data[0])
+        self.daily_stats.record(today, word_data[0], known)
+
+        self.next_word()
+        return word_data
+
+    @property
+    def pending(self):
+        return bool(self.repo and self.repo.pending)
+
+    def flush(self):
+        self.repo.flush()
+
+    def clear_known(self):
+        self.clear_table("known_vocab")
+
+    def clear_new(self):
+        self.clear_table("new_vocab")
+
+    def clear_table(self, table_name):
+        self.repo.clear_table(table_name)
+        # Clearing new_vocab also changes the weights of the other tables
+        self.picker = None
+        if self.current_table == table_name:
+            self.word_index.clear()
+            self.due_queue.clear()
+
+    def refresh(self, full=False):
+        # Rebuilds vocab_exe; an error from the database is raised after the
+        # session has been reset
+        added = None
+        try:
+            added = self.repo.refresh_exe(full)
+        finally:
+            # Only vocab_exe changes, and only when words were put back
+            if self.current_table == "vocab_exe" and added != 0:
+                self.load_vocabulary_data()
+            self.current_id = self.word_index.first_id()
+
+    def today_stats(self):
+        # Today's totals across sessions
+        return dict(self.daily_stats.stats.get(datetime.date.today().isoformat(),
+                                               {"reviewed": 0, "known": 0, "unknown": 0}))
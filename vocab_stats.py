@@ -0,0 +1,138 @@
+import os
+from collections import OrderedDict
+
+STAT_KEYS = {"Y": "known", "N": "unknown"}
+
+
+class DailyStats:
+    # Daily totals of the review log, kept in memory and persisted to the
+    # stats file as "date,reviewed,known,unknown" lines. A day's line is
+    # written once at a fixed width and then overwritten in place, so a flush
+    # never rewrites the history; when a date appears twice the later line
+    # wins. Loading only reads back enough of the file's tail for `days` days.
+    def __init__(self, log_file=None, days=7):
+        self.log_file = log_file
+        self.days = days
+        self.stats = OrderedDict()
+        self.offsets = {}
+        self.dirty = set()
+        # Latest mark of every word reviewed on marks_date
+        self.marks = {}
+        self.marks_date = None
+
+    def recent(self, days=None):
+        return list(self.stats.items())[-(days or self.days):]
+
+    def day(self, date):
+        if date not in self.stats:
+            self.stats[date] = {"reviewed": 0, "known": 0, "unknown": 0}
+        return self.stats[date]
+
+    def record(self, date, word_id, known):
+        if date != self.marks_date:
+            self.marks = {}
+            self.marks_date = date
+        day = self.day(date)
+        day["reviewed"] += 1
+        previous = self.marks.get(word_id)
+        if previous != known:
+            if previous is not None:
+                day[STAT_KEYS[previous]] -= 1
+            day[STAT_KEYS[known]] += 1
+            self.marks[word_id] = known
+        self.dirty.add(date)
+
+    def seed(self, date, reviews):
+        # Rebuild a day from its review events, e.g. those of an earlier session
+        if not reviews:
+            return
+        self.stats.pop(date, None)
+        self.marks = {}
+        self.marks_date = date
+        for word_id, known in reviews:
+            self.record(date, word_id, known)
+
+    def merge(self, totals):
+        # (date, reviewed, known, unknown) days from the deck's review log,
+        # which also has the reviews of other windows and the server; they
+        # replace the stats file's lines for the same days
+        for date, reviewed, known, unknown in totals:
+            self.stats[date] = {"reviewed": reviewed, "known": known, "unknown": unknown}
+        self.stats = OrderedDict(sorted(self.stats.items()))
+
+    def load(self):
+        self.stats.clear()
+        self.offsets.clear()
+        self.dirty.clear()
+        if not self.log_file or not os.path.exists(self.log_file):
+            return
+        for offset, line in self._tail_lines():
+            date, reviewed, known, unknown = line.split(',')
+            self.stats.pop(date, None)
+            self.stats[date] = {
+                "reviewed": int(reviewed),
+                "known": int(known),
+                "unknown": int(unknown)
+            }
+            self.offsets[date] = offset
+
+    def _tail_lines(self):
+        # Read blocks backwards until they hold enough distinct dates
+        with open(self.log_file, 'rb') as f:
+            end = f.seek(0, os.SEEK_END)
+            start = end
+            block = 4096
+            data = b""
+            first = 0
+            while start > 0:
+                start = max(0, start - block)
+                block *= 2
+                f.seek(start)
+                data = f.read(end - start)
+                # Unless this is the start of the file, the first line is cut off
+                first = 0 if start == 0 else data.find(b"\n") + 1
+                if first == 0 and start > 0:
+                    continue
+                dates = {line.split(b",", 1)[0] for line in data[first:].splitlines() if line.strip()}
+                if len(dates) > self.days:
+                    break
+
+        lines = []
+        offset = start + first
+        for line in data[first:].splitlines(keepends=True):
+            if line.strip():
+                lines.append((offset, line.decode("utf-8").strip()))
+            offset += len(line)
+        return lines
+
+    def _format(self, date):
+        stats = self.stats[date]
+        return f"{date},{stats['reviewed']:>8},{stats['known']:>8},{stats['unknown']:>8}\n".encode("utf-8")
+
+    def flush(self):
+        if not self.dirty or not self.log_file:
+            return
+        mode = 'r+b' if os.path.exists(self.log_file) else 'w+b'
+        with open(self.log_file, mode) as f:
+            for date in sorted(self.dirty):
+                line = self._format(date)
+                offset = self.offsets.get(date)
+                # Rewrite in place only over a line of exactly the same width
+                if offset is not None and self._same_width(f, offset, line):
+                    f.seek(offset)
+                    f.write(line)
+                    continue
+                end = f.seek(0, os.SEEK_END)
+                if end > 0:
+                    f.seek(end - 1)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                        end += 1
+                f.write(line)
+                self.offsets[date] = end
+        self.dirty.clear()
+
+    def _same_width(self, f, offset, line):
+        f.seek(offset)
+        current = f.readline()
+        return len(current) == len(line) and current.startswith(line.split(b",", 1)[0] + b",")
@@ -0,0 +1,286 @@
+import functools
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+
+# Opt-in latency tracing. While disabled nothing is wrapped: instrument()
+# only replaces methods once tracing is on, connections only get the traced
+# factory when opened with tracing on, and keypress timing costs one
+# attribute check. While enabled every span and SQL statement goes into a
+# per-operation histogram, and into a bounded buffer of events that export()
+# writes as Chrome trace-event JSON (chrome://tracing, Perfetto).
+now = time.perf_counter
+
+
+class Histogram:
+    # Latencies in log-spaced buckets, SUB per doubling (about 19% wide)
+    SUB = 4
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+
+    def add(self, seconds, rows=0):
+        us = seconds * 1e6
+        bucket = int(math.log2(us) * self.SUB) + 1 if us >= 1 else 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.rows += rows
+
+    def percentile(self, q):
+        # Upper edge of the bucket holding the q-th percentile, in seconds
+        target = q / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= target:
+                return min(2 ** (bucket / self.SUB) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "p50_ms": self.percentile(50) * 1000,
+            "p95_ms": self.percentile(95) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+            "max_ms": self.max * 1000,
+            "rows": self.rows,
+        }
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.events = deque()
+        self.histograms = {}
+        self.origin = now()
+        self.lock = threading.Lock()
+        self.patched = []
+
+    def enable(self, max_events=200000):
+        self.events = deque(self.events, maxlen=max_events)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        # Put back every method instrument() replaced
+        for owner, name, original in reversed(self.patched):
+            setattr(owner, name, original)
+        self.patched = []
+
+    def record(self, name, start, category="span", args=None, rows=0):
+        end = now()
+        with self.lock:
+            histogram = self.histograms.get((category, name))
+            if histogram is None:
+                histogram = self.histograms[(category, name)] = Histogram()
+            histogram.add(end - start, rows)
+        event = {"name": name, "cat": category, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                 "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6}
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def span(self, name, category="span", **args):
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, name, category, args)
+
+    def instrument(self, owner, names, category="span"):
+        # Times every call of owner's methods names, as "Owner.name"
+        if not self.enabled:
+            return
+        for name in names:
+            original = owner.__dict__[name]
+            label = f"{owner.__name__}.{name}"
+            setattr(owner, name, self._timed(original, label, category))
+            self.patched.append((owner, name, original))
+
+    def _timed(self, function, label, category):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = now()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(label, start, category)
+        return timed
+
+    def summary(self):
+        with self.lock:
+            return {f"{category}:{name}": histogram.summary()
+                    for (category, name), histogram in sorted(self.histograms.items())}
+
+    def export(self, path):
+        # Written under a temporary name, so a trace is never half written
+        data = {"traceEvents": list(self.events), "displayTimeUnit": "ms",
+                "otherData": {"histograms": self.summary(), "dropped_events": self.events.maxlen is not None
+                              and len(self.events) == self.events.maxlen}}
+        tmp_file = path + ".part"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, path)
+
+    def print_summary(self, file=sys.stderr):
+        print(f"{'operation':<56} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'rows':>8}",
+              file=file)
+        for name, s in self.summary().items():
+            print(f"{name[:56]:<56} {s['count']:>7} {s['p50_ms']:>8.3f} {s['p95_ms']:>8.3f} {s['p99_ms']:>8.3f} "
+                  f"{s['max_ms']:>8.3f} {s['rows']:>8}", file=file)
+
+
+class Span:
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = now()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.start, self.category, self.args)
+        return False
+
+
+class NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = NoSpan()
+tracer = Tracer()
+
+
+def statement_name(sql):
+    return " ".join(sql.split())[:200]
+
+
+class TracedCursor(sqlite3.Cursor):
+    # Times each statement from execute() until its rows are read. A
+    # statement is recorded when it is done: right away for writes, and for
+    # queries once the last row is fetched, the next statement starts or the
+    # cursor goes away, as the one behind conn.execute(...).fetchone() does.
+    def _begin(self, sql):
+        self._finish()
+        self._sql = sql
+        self._start = now()
+        self._rows = 0
+
+    def _finish(self):
+        sql = getattr(self, "_sql", None)
+        if sql is None:
+            return
+        self._sql = None
+        rows = self._rows if self.description is not None else max(self.rowcount, 0)
+        tracer.record(statement_name(sql), self._start, "sql", {"rows": rows}, rows)
+
+    def execute(self, sql, parameters=()):
+        self._begin(sql)
+        try:
+            super().execute(sql, parameters)
+        finally:
+            if self.description is None:
+                self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._begin(sql)
+        try:
+            super().executemany(sql, seq_of_parameters)
+        finally:
+            self._finish()
+        return self
+
+    def _fetched(self, rows, done):
+        self._rows += rows
+        if done:
+            self._finish()
+
+    def fetchone(self):
+        row = super().fetchone()
+        self._fetched(row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._fetched(len(rows), True)
+        return rows
+
+    def __next__(self):
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._finish()
+            raise
+        self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+class TracedConnection(sqlite3.Connection):
+    # Connection.execute() would create a plain cursor, so it goes through
+    # cursor() here
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = now()
+        try:
+            super().commit()
+        finally:
+            tracer.record("COMMIT", start, "sql")
+
+    def rollback(self):
+        start = now()
+        try:
+            super().rollback()
+        finally:
+            tracer.record("ROLLBACK", start, "sql")
+
+    # "with conn:" commits or rolls back inside sqlite3, past the methods
+    # above, so the transaction's end is timed here
+    def __exit__(self, exc_type, exc_value, traceback):
+        start = now()
+        try:
+            return super().__exit__(exc_type, exc_value, traceback)
+        finally:
+            tracer.record("COMMIT" if exc_type is None else "ROLLBACK", start, "sql")
+
+
+def connection_factory():
+    # For sqlite3.connect(factory=...): traced while tracing is on
+    return TracedConnection if tracer.enabled else sqlite3.Connection